@@ -0,0 +1,101 @@
+import os
+import math
+import time
+import asyncio
+
+from observability import ADMISSION_ACTIVE, ADMISSION_WAITING, ADMISSION_REJECTED
+
+# --- Admission Control Configuration ---
+# Book requests processed at the same time. A slot is held for the whole request, most
+# of which is spent waiting on Gemini and the heading service; CPU-bound rendering is
+# bounded separately by RENDER_WORKERS. This limit only guards memory and upstream load.
+MAX_ACTIVE_REQUESTS = int(os.environ.get("MAX_ACTIVE_REQUESTS", "32"))
+# Requests allowed to wait for a slot; beyond this the server answers 503 right away.
+MAX_QUEUED_REQUESTS = int(os.environ.get("MAX_QUEUED_REQUESTS", "16"))
+# Longest time a request may wait in the queue before it is turned away (seconds); longer
+# than one book takes, so a queued request is normally served.
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "600"))
+
+# Endpoints that run the book pipeline and are subject to admission control.
+ADMITTED_PATHS = ("/process-pdf", "/match-toc-java", "/extract-toc")
+
+# Assumed request duration (seconds) for the Retry-After estimate until one has finished.
+_INITIAL_DURATION_ESTIMATE = 30.0
+_DURATION_SMOOTHING = 0.2
+
+
+class Saturated(Exception):
+    """Raised when a request cannot be admitted; `retry_after` is a hint in seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server is saturated; retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds concurrent book requests to `max_active`, lets up to `max_queued` more wait
+    in FIFO order and rejects the rest immediately. Waiting happens before the request
+    body is read, so queued uploads do not take memory either.
+    """
+
+    def __init__(self, max_active: int, max_queued: int, queue_timeout: float):
+        self.max_active = max(1, max_active)
+        self.max_queued = max(0, max_queued)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.average_seconds = _INITIAL_DURATION_ESTIMATE
+        self._semaphore = None
+
+    def retry_after(self) -> int:
+        """Estimated seconds until a newly arriving request would be served."""
+        queued_ahead = max(0, self.active + self.waiting - self.max_active)
+        return max(1, math.ceil(self.average_seconds * (queued_ahead + 1) / self.max_active))
+
+    async def acquire(self) -> float:
+        """
+        Waits for a slot; raises Saturated when the queue is full or the wait times out.
+        Returns the admission time to hand back to `release`.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_active)
+        if self.active + self.waiting >= self.max_active + self.max_queued:
+            ADMISSION_REJECTED.labels("queue_full").inc()
+            raise Saturated(self.retry_after())
+
+        self.waiting += 1
+        ADMISSION_WAITING.inc()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            ADMISSION_REJECTED.labels("queue_timeout").inc()
+            raise Saturated(self.retry_after())
+        finally:
+            self.waiting -= 1
+            ADMISSION_WAITING.dec()
+
+        self.active += 1
+        ADMISSION_ACTIVE.inc()
+        return time.monotonic()
+
+    def release(self, started: float) -> None:
+        self.active -= 1
+        ADMISSION_ACTIVE.dec()
+        self._semaphore.release()
+        elapsed = time.monotonic() - started
+        self.average_seconds += _DURATION_SMOOTHING * (elapsed - self.average_seconds)
+
+    async def hold_until_sent(self, body_iterator, started: float):
+        """
+        Wraps a response body so the slot is released only once the body has been sent;
+        streamed responses keep doing work after the endpoint has returned.
+        """
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            self.release(started)
+
+
+controller = AdmissionController(MAX_ACTIVE_REQUESTS, MAX_QUEUED_REQUESTS, ADMISSION_QUEUE_TIMEOUT)
@@ -0,0 +1,233 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import uuid
+import asyncio
+import logging
+import argparse
+import tempfile
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Awaitable, List, Optional
+
+from observability import setup_logging
+
+# --- Batch Configuration ---
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "2"))
+BATCH_OUTPUT_DIR = os.environ.get("BATCH_OUTPUT_DIR", "final_analysis")
+OUTPUT_PREFIX = "final_book_analysis_"
+# Directories batches started through POST /batch may read PDFs and manifests from
+# (separated by os.pathsep). Empty disables the API; the command line is not restricted.
+BATCH_INPUT_ROOTS = [root for root in os.environ.get("BATCH_INPUT_ROOTS", "").split(os.pathsep) if root]
+# Directory (with its subdirectories) that batches started through the API may write to.
+BATCH_OUTPUT_ROOT = os.environ.get("BATCH_OUTPUT_ROOT", BATCH_OUTPUT_DIR)
+# Books of all batches started through the API processed at once; a batch's requested
+# concurrency is capped to it. API batches do not pass admission control, so this bounds
+# their load instead.
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "4"))
+# How long finished API batches can still be fetched.
+BATCH_RETENTION_SECONDS = int(os.environ.get("BATCH_RETENTION_SECONDS", str(24 * 3600)))
+
+logger = logging.getLogger(__name__)
+
+
+def output_path_for(pdf_path: str, output_dir: str) -> Path:
+    """
+    One result file per book, named after the PDF like the files in final_analysis/
+    (every character that is not a letter or digit becomes '_'), plus a short hash of
+    the PDF's full path: books with the same name in different folders, or names that
+    only differ in punctuation, must not share a file.
+    """
+    safe_name = re.sub(r"[^A-Za-z0-9]", "_", Path(pdf_path).stem)
+    path_hash = hashlib.sha256(str(Path(pdf_path).resolve()).encode("utf-8")).hexdigest()[:10]
+    return Path(output_dir) / f"{OUTPUT_PREFIX}{safe_name}_{path_hash}.json"
+
+
+def is_within(path: str, roots: List[str]) -> bool:
+    """True if `path` (after resolving symlinks and '..') lies inside one of `roots`."""
+    resolved = Path(path).resolve()
+    return any(resolved.is_relative_to(Path(root).resolve()) for root in roots)
+
+
+def collect_pdfs(directory: Optional[str] = None, manifest: Optional[str] = None) -> List[str]:
+    """
+    Returns the PDFs to process from a directory (searched recursively) and/or a
+    manifest file. A manifest is either a JSON list of paths or a text file with one
+    path per line; relative paths are resolved against the manifest's folder.
+    """
+    pdf_paths = []
+    if directory:
+        pdf_paths.extend(str(path) for path in sorted(Path(directory).rglob("*")) if path.suffix.lower() == ".pdf")
+    if manifest:
+        manifest_path = Path(manifest)
+        text = manifest_path.read_text(encoding="utf-8")
+        if manifest_path.suffix.lower() == ".json":
+            entries = json.loads(text)
+        else:
+            entries = [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#")]
+        for entry in entries:
+            path = Path(entry)
+            if not path.is_absolute():
+                path = manifest_path.parent / path
+            pdf_paths.append(str(path))
+    # Keep the first occurrence of every path.
+    return list(dict.fromkeys(pdf_paths))
+
+
+class BatchRun:
+    """Progress of one batch: which books are done, skipped, running or failed."""
+
+    def __init__(self, pdf_paths: List[str], output_dir: str, concurrency: int):
+        self.id = uuid.uuid4().hex
+        self.pdf_paths = pdf_paths
+        self.output_dir = output_dir
+        self.concurrency = concurrency
+        self.completed = []
+        self.skipped = []
+        self.running = []
+        self.failed = {}
+        self.started_at = time.time()
+        self.finished_at = None
+        self.task = None
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def to_dict(self) -> dict:
+        processed = len(self.completed) + len(self.skipped) + len(self.failed)
+        return {
+            "batch_id": self.id,
+            "status": "finished" if self.finished else "running",
+            "output_dir": self.output_dir,
+            "concurrency": self.concurrency,
+            "total": len(self.pdf_paths),
+            "processed": processed,
+            "completed": len(self.completed),
+            "skipped": len(self.skipped),
+            "running": list(self.running),
+            "failed": self.failed,
+            "elapsed_seconds": round((self.finished_at or time.time()) - self.started_at, 1),
+        }
+
+
+def _write_json_atomic(path: Path, data) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+async def run_batch(run: BatchRun, process_fn: Callable[[str], Awaitable[dict]],
+                    shared_slots: Optional[asyncio.Semaphore] = None) -> BatchRun:
+    """
+    Processes every PDF of `run` with at most `run.concurrency` books in flight, each
+    also holding one of `shared_slots` if given.
+    Books whose output file already exists are skipped, so an interrupted batch can
+    simply be started again. A failing book is recorded and does not stop the batch.
+    """
+    semaphore = asyncio.Semaphore(max(1, run.concurrency))
+
+    async def process_one(pdf_path: str):
+        output_path = output_path_for(pdf_path, run.output_dir)
+        if output_path.exists():
+            run.skipped.append(pdf_path)
+            return
+        async with semaphore, shared_slots or nullcontext():
+            run.running.append(pdf_path)
+            logger.info("[BATCH %s] Processing %s", run.id[:8], pdf_path)
+            try:
+                result = await process_fn(pdf_path)
+                if not isinstance(result, dict):
+                    raise RuntimeError("pipeline returned no result")
+                if "error" in result:
+                    raise RuntimeError(result["error"])
+                if not result.get("toc"):
+                    # Not written, so the book is retried on the next run.
+                    raise RuntimeError("pipeline produced an empty TOC")
+                _write_json_atomic(output_path, result)
+                run.completed.append(pdf_path)
+            except Exception as e:
+                logger.error("[BATCH %s] Failed %s: %s", run.id[:8], pdf_path, e)
+                run.failed[pdf_path] = str(e)
+            finally:
+                run.running.remove(pdf_path)
+        progress = run.to_dict()
+        logger.info("[BATCH %s] %d/%d processed (%d done, %d skipped, %d failed)", run.id[:8],
+                    progress["processed"], progress["total"], progress["completed"], progress["skipped"], len(run.failed))
+
+    try:
+        await asyncio.gather(*(process_one(pdf_path) for pdf_path in run.pdf_paths))
+    finally:
+        run.finished_at = time.time()
+    return run
+
+
+# Batches started through the API, by id.
+batches = {}
+# BATCH_MAX_CONCURRENCY slots shared by the books of all API batches.
+_api_slots = None
+
+
+def start_batch(pdf_paths: List[str], output_dir: str, concurrency: int,
+                process_fn: Callable[[str], Awaitable[dict]]) -> BatchRun:
+    """
+    Starts a batch in the background of the running event loop and registers it.
+    `concurrency` is capped to BATCH_MAX_CONCURRENCY.
+    """
+    global _api_slots
+    if _api_slots is None:
+        _api_slots = asyncio.Semaphore(max(1, BATCH_MAX_CONCURRENCY))
+    purge_batches()
+    run = BatchRun(pdf_paths, output_dir, min(max(1, concurrency), max(1, BATCH_MAX_CONCURRENCY)))
+    batches[run.id] = run
+    run.task = asyncio.create_task(run_batch(run, process_fn, _api_slots))
+    return run
+
+
+def purge_batches(retention_seconds: Optional[int] = None) -> int:
+    """Forgets API batches that finished more than the retention period ago."""
+    retention_seconds = BATCH_RETENTION_SECONDS if retention_seconds is None else retention_seconds
+    cutoff = time.time() - retention_seconds
+    expired = [batch_id for batch_id, run in batches.items() if run.finished and run.finished_at < cutoff]
+    for batch_id in expired:
+        del batches[batch_id]
+    return len(expired)
+
+
+## Command-line entry point: runs the same pipeline as /process-pdf over a library.
+async def main():
+    parser = argparse.ArgumentParser(description="Run the book analysis pipeline over many PDFs.")
+    parser.add_argument("--dir", help="Directory to search (recursively) for PDFs.")
+    parser.add_argument("--manifest", help="JSON list or text file (one path per line) of PDFs.")
+    parser.add_argument("--out", default=BATCH_OUTPUT_DIR, help="Directory for the per-book result JSON files.")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Books processed at once.")
+    args = parser.parse_args()
+    setup_logging()
+
+    if not args.dir and not args.manifest:
+        parser.error("one of --dir or --manifest is required")
+    pdf_paths = collect_pdfs(args.dir, args.manifest)
+    if not pdf_paths:
+        print("No PDFs found.")
+        sys.exit(1)
+
+    # Imported here so that importing this module from main.py does not import main.py back.
+    from main import analyze_pdf_file
+
+    run = await run_batch(BatchRun(pdf_paths, args.out, args.concurrency), analyze_pdf_file)
+    print(json.dumps(run.to_dict(), indent=2))
+    if run.failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,440 @@
+"""
+Offline benchmark for the FastAPI app.
+
+Runs /process-pdf, /extract-toc and /match-toc-java in-process against local
+stand-ins for Gemini (configurable latency, errors and 429s) and for the Java
+heading service (replaying detected_headings.json-style payloads). Reports
+p50/p95 latency, requests per second at each concurrency level, peak memory and
+TOC accuracy against the ground truth in ../bookdata.
+
+Usage:
+    python benchmark.py --concurrency 1 4 16 --requests 32 --gemini-latency 1.5
+    python benchmark.py --pdf-dir ~/books --headings ../detected_headings.json
+"""
+import os
+import sys
+
+# Must be set before the app modules are imported: no real key is ever used, and every
+# benchmark request should do the full work unless --cache is given.
+os.environ["GEMINI_API_KEY"] = "benchmark-fake-key"
+if "--cache" not in sys.argv:
+    os.environ["RESULT_CACHE_ENABLED"] = "0"
+# Keep the app's own logging out of the report unless asked for.
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import io
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request, UploadFile, File
+from fastapi.responses import JSONResponse
+from reportlab.pdfgen import canvas
+
+import main
+import toc_logic
+import toc_matcher
+import gemini_scheduler
+from prometheus_client import REGISTRY
+
+BOOKDATA_PATH = Path(__file__).resolve().parent.parent / "bookdata"
+ENDPOINTS = ["/process-pdf", "/extract-toc", "/match-toc-java"]
+# Pages before the first numbered page of a synthetic book (title, copyright, contents).
+SYNTHETIC_FRONT_PAGES = 3
+
+
+class FakeConfig:
+    """Behaviour shared by the fake Gemini and the fake heading service."""
+
+    def __init__(self, args):
+        self.gemini_latency = args.gemini_latency
+        self.gemini_jitter = args.gemini_jitter
+        self.gemini_error_rate = args.gemini_error_rate
+        self.gemini_429_rate = args.gemini_429_rate
+        self.headings_latency = args.headings_latency
+        self.discovery_toc_calls = args.discovery_toc_calls
+        self.book = None
+        self.headings = None
+        self.gemini_calls = 0
+        self.lock = threading.Lock()
+        self.discovery_calls_by_book = {}
+
+    def gemini_delay(self) -> float:
+        return max(0.0, random.gauss(self.gemini_latency, self.gemini_jitter))
+
+    def gemini_failure(self) -> Optional[str]:
+        """A simulated failure message, or None for a successful call."""
+        roll = random.random()
+        if roll < self.gemini_429_rate:
+            return "429 Resource has been exhausted (e.g. check quota)."
+        if roll < self.gemini_429_rate + self.gemini_error_rate:
+            return "503 The service is currently unavailable."
+        return None
+
+
+# --- Ground truth and synthetic books ---
+
+def load_ground_truth(path: Path) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def synthetic_layout(book: dict) -> List[int]:
+    """Physical page of every TOC chapter in the synthetic PDF (strictly increasing)."""
+    pages = []
+    previous = SYNTHETIC_FRONT_PAGES
+    for entry in book["toc"]:
+        page = max(previous + 1, (entry.get("page_start") or 0) + SYNTHETIC_FRONT_PAGES)
+        pages.append(page)
+        previous = page
+    return pages
+
+
+def build_synthetic_pdf(book: dict, with_outline: bool) -> bytes:
+    """
+    A text-layer PDF with a title page, a copyright page, a dot-leader contents page and
+    one heading page per chapter at the physical pages given by synthetic_layout().
+    """
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+    pdf.setTitle(book["book_title"])
+    pdf.setAuthor(", ".join(book.get("authors") or []))
+    pdf.setFont("Helvetica-Bold", 24)
+    pdf.drawString(72, 700, book["book_title"][:60])
+    pdf.showPage()
+    pdf.setFont("Helvetica", 10)
+    pdf.drawString(72, 700, "Copyright. All rights reserved.")
+    pdf.showPage()
+    pdf.setFont("Helvetica-Bold", 16)
+    pdf.drawString(72, 760, "Contents")
+    pdf.setFont("Helvetica", 10)
+    y = 730
+    for entry in book["toc"]:
+        pdf.drawString(72, y, f"{entry['chapter_full_title'][:70]} {'.' * 12} {entry.get('page_start') or ''}")
+        y -= 16
+    pdf.showPage()
+
+    chapter_pages = dict(zip(synthetic_layout(book), book["toc"]))
+    for page in range(SYNTHETIC_FRONT_PAGES + 1, max(chapter_pages) + 2):
+        entry = chapter_pages.get(page)
+        if entry is not None:
+            if with_outline:
+                key = f"chapter-{page}"
+                pdf.bookmarkPage(key)
+                pdf.addOutlineEntry(entry["chapter_full_title"], key, level=0)
+            pdf.setFont("Helvetica-Bold", 20)
+            pdf.drawString(72, 700, entry["chapter_full_title"][:50])
+        pdf.setFont("Helvetica", 10)
+        pdf.drawString(72, 600, f"Body text of page {page}.")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def synthetic_headings(book: dict, pages: List[int]) -> List[dict]:
+    """Noisy heading payload in the Java service's format: split titles plus junk entries."""
+    headings = []
+    for entry, page in zip(book["toc"], pages):
+        title = entry["chapter_full_title"]
+        if ":" in title:
+            first, rest = title.split(":", 1)
+            headings.append({"title": first + ":", "pageNumber": page, "level": 1})
+            headings.append({"title": rest.strip(), "pageNumber": page, "level": 1})
+        else:
+            headings.append({"title": title.upper(), "pageNumber": page, "level": 1})
+        headings.append({"title": random.choice(["the", "*", "of", "LEVEL"]), "pageNumber": page + 1, "level": 1})
+        headings.append({"title": book["book_title"], "pageNumber": page + 2, "level": 0})
+    return headings
+
+
+# --- Fake Gemini (SDK and REST) ---
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def make_fake_generative_model(config: FakeConfig):
+    class FakeGenerativeModel:
+        """Stand-in for genai.GenerativeModel answering from the current book's ground truth."""
+
+        def __init__(self, model_name: str):
+            self.model_name = f"models/{model_name}"
+
+        def generate_content(self, contents=None, generation_config=None):
+            time.sleep(config.gemini_delay())
+            with config.lock:
+                config.gemini_calls += 1
+            failure = config.gemini_failure()
+            if failure:
+                raise RuntimeError(failure)
+            book = config.book
+            toc_entries = [
+                {
+                    "chapter_title": entry["chapter_full_title"],
+                    "page_number": entry.get("page_start") or 0,
+                    "reference_boolean": entry["chapter_full_title"].strip().lower() in ("bibliography", "references"),
+                }
+                for entry in book["toc"]
+            ]
+            if self.model_name.endswith(toc_logic.DISCOVERY_MODEL):
+                # Only the first discovery chunks of each request "see" the contents pages.
+                request_id = gemini_scheduler._book_sequence.get()
+                with config.lock:
+                    seen = config.discovery_calls_by_book.get(request_id, 0)
+                    config.discovery_calls_by_book[request_id] = seen + 1
+                if seen >= config.discovery_toc_calls:
+                    toc_entries = []
+            return FakeResponse(json.dumps({
+                "metadata": {
+                    "book_title": book["book_title"],
+                    "authors": book.get("authors"),
+                    "publishing_house": None,
+                    "publishing_year": None,
+                },
+                "toc_entries": toc_entries,
+            }))
+
+    return FakeGenerativeModel
+
+
+def build_fake_services(config: FakeConfig) -> FastAPI:
+    fake = FastAPI()
+
+    @fake.post("/v1beta/models/{model_action}")
+    async def generate_content(model_action: str, request: Request):
+        await request.body()
+        await asyncio.sleep(config.gemini_delay())
+        config.gemini_calls += 1
+        failure = config.gemini_failure()
+        if failure:
+            return JSONResponse(status_code=int(failure[:3]), content={"error": {"message": failure}})
+        book = config.book
+        chapters = [
+            {"title": entry["chapter_full_title"], "pageNumber": page, "level": 1}
+            for entry, page in zip(book["toc"], book["physical_pages"])
+        ]
+        return {"candidates": [{"content": {"parts": [{"text": json.dumps(chapters)}]}}]}
+
+    @fake.post("/detect-chapter-headings")
+    async def detect_chapter_headings(file: UploadFile = File(...)):
+        await file.read()
+        await asyncio.sleep(config.headings_latency)
+        return config.headings
+
+    return fake
+
+
+def start_fake_server(app: FastAPI, port: int):
+    """Serves `app` from a background thread. Port 0 picks a free port; returns (server, port)."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, server.servers[0].sockets[0].getsockname()[1]
+
+
+# --- Measurement ---
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def image_bytes_sent() -> float:
+    """Total page-image bytes sent to Gemini so far (from the app's payload histogram)."""
+    return REGISTRY.get_sample_value("pdf_lens_payload_bytes_sum", {"kind": "gemini_images"}) or 0.0
+
+
+def unique_pdf(pdf_bytes: bytes, n: int, share_bytes: bool) -> bytes:
+    """
+    Appends a PDF comment after %%EOF so every request has a distinct hash and neither
+    the result cache nor in-flight sharing hides the real work.
+    """
+    return pdf_bytes if share_bytes else pdf_bytes + f"\n%benchmark-request-{n}\n".encode("ascii")
+
+
+async def run_load(client: httpx.AsyncClient, endpoint: str, pdf_bytes: bytes, requests: int,
+                   concurrency: int, share_bytes: bool) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(n: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(
+                endpoint, files={"file": ("book.pdf", unique_pdf(pdf_bytes, n, share_bytes), "application/pdf")}
+            )
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200 or "error" in response.json():
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(requests)))
+    wall = time.perf_counter() - started
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "rps": round(requests / wall, 2) if wall else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def score_accuracy(book: dict, toc: List[dict]) -> dict:
+    """
+    Compares a /process-pdf TOC with the ground truth.
+    * title_recall: share of true chapters found (normalized title similarity >= 0.9).
+    * page_accuracy: share of true chapters whose page is right. For synthetic books the
+      exact physical page is known; for real PDFs, printed and physical pages differ by
+      the front matter, so the most common offset is taken as correct.
+    """
+    predicted = []
+    for entry in toc:
+        norm = toc_matcher.normalize_title(entry.get("title") or entry.get("chapter_title") or "")
+        predicted.append((norm, set(norm.split()), entry.get("pageNumber")))
+    found = 0
+    offsets = []
+    for truth, physical in zip(book["toc"], book["physical_pages"]):
+        norm = toc_matcher.normalize_title(truth["chapter_full_title"])
+        tokens = set(norm.split())
+        best = max(
+            ((toc_matcher.title_similarity(norm, tokens, p_norm, p_tokens), page) for p_norm, p_tokens, page in predicted),
+            default=(0.0, None),
+            key=lambda pair: pair[0],
+        )
+        if best[0] >= 0.9:
+            found += 1
+            if isinstance(best[1], int):
+                expected = physical if physical is not None else truth.get("page_start")
+                if expected is not None:
+                    offsets.append(best[1] - expected)
+    total = len(book["toc"]) or 1
+    if book["synthetic"]:
+        correct = sum(1 for offset in offsets if offset == 0)
+    else:
+        correct = max((offsets.count(offset) for offset in set(offsets)), default=0)
+    return {"title_recall": round(found / total, 3), "page_accuracy": round(correct / total, 3)}
+
+
+# --- Driver ---
+
+async def run_benchmark(args) -> dict:
+    config = FakeConfig(args)
+    toc_logic.genai.GenerativeModel = make_fake_generative_model(config)
+    fake_server, fake_port = start_fake_server(build_fake_services(config), args.fake_port)
+    base = f"http://127.0.0.1:{fake_port}"
+    main.GEMINI_API_BASE = base
+    main.JAVA_HEADINGS_URL = f"{base}/detect-chapter-headings"
+    main.HEADINGS_BACKEND = args.headings_backend
+    replayed_headings = json.loads(Path(args.headings).read_text(encoding="utf-8")) if args.headings else None
+
+    books = load_ground_truth(Path(args.bookdata))
+    if args.books:
+        books = books[:args.books]
+
+    report = {"scenarios": [], "accuracy": []}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for book in books:
+            real_pdf = Path(args.pdf_dir) / book["File Name"] if args.pdf_dir else None
+            if real_pdf is not None and real_pdf.exists():
+                pdf_bytes = real_pdf.read_bytes()
+                book["synthetic"] = False
+                book["physical_pages"] = [None] * len(book["toc"])
+            else:
+                book["synthetic"] = True
+                book["physical_pages"] = synthetic_layout(book)
+                pdf_bytes = build_synthetic_pdf(book, args.outline)
+            config.book = book
+            config.headings = replayed_headings or synthetic_headings(
+                book, [page if page is not None else entry.get("page_start") or 0
+                       for entry, page in zip(book["toc"], book["physical_pages"])]
+            )
+            print(f"\n=== {book['book_title']} ({'synthetic' if book['synthetic'] else real_pdf}) ===")
+
+            response = await client.post("/process-pdf", files={"file": ("book.pdf", unique_pdf(pdf_bytes, -1, False), "application/pdf")})
+            accuracy = {"book": book["book_title"], **score_accuracy(book, response.json().get("toc", []))}
+            report["accuracy"].append(accuracy)
+            print(f"accuracy: {accuracy}")
+
+            for endpoint in args.endpoints:
+                for concurrency in args.concurrency:
+                    calls_before = config.gemini_calls
+                    bytes_before = image_bytes_sent()
+                    scenario = await run_load(client, endpoint, pdf_bytes, args.requests, concurrency, args.cache)
+                    scenario["book"] = book["book_title"]
+                    scenario["gemini_calls"] = config.gemini_calls - calls_before
+                    scenario["image_bytes_per_request"] = round((image_bytes_sent() - bytes_before) / args.requests)
+                    report["scenarios"].append(scenario)
+                    print(
+                        f"{endpoint:16} c={concurrency:<3} p50={scenario['p50_s']:.3f}s p95={scenario['p95_s']:.3f}s "
+                        f"rps={scenario['rps']:.2f} errors={scenario['errors']} "
+                        f"gemini_calls={scenario['gemini_calls']} image_bytes/req={scenario['image_bytes_per_request']} "
+                        f"peak_rss={scenario['peak_rss_mb']}MB"
+                    )
+    await main.shutdown_http_clients()
+    fake_server.should_exit = True
+
+    report["scheduler"] = {
+        "retries": gemini_scheduler.scheduler.retries,
+        "rate_limited": gemini_scheduler.scheduler.rate_limited,
+    }
+    report["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline latency/throughput/accuracy benchmark.")
+    parser.add_argument("--bookdata", default=str(BOOKDATA_PATH), help="Ground-truth JSON (bookdata format).")
+    parser.add_argument("--pdf-dir", help="Directory with the real PDFs named as in 'File Name'; synthetic PDFs otherwise.")
+    parser.add_argument("--books", type=int, help="Only benchmark the first N books.")
+    parser.add_argument("--headings", help="detected_headings.json-style payload to replay instead of synthetic headings.")
+    parser.add_argument("--outline", action="store_true", help="Give synthetic PDFs bookmarks (outline fast path).")
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=16, help="Requests per endpoint and concurrency level.")
+    parser.add_argument("--cache", action="store_true", help="Keep the result cache on and send identical PDFs.")
+    parser.add_argument("--gemini-latency", type=float, default=1.0, help="Mean fake Gemini latency (s).")
+    parser.add_argument("--gemini-jitter", type=float, default=0.2, help="Std deviation of the fake latency (s).")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="Share of calls failing with 503.")
+    parser.add_argument("--gemini-429-rate", type=float, default=0.0, help="Share of calls failing with 429.")
+    parser.add_argument("--discovery-toc-calls", type=int, default=1,
+                        help="Discovery calls per request that report TOC entries (image path only).")
+    parser.add_argument("--headings-backend", default="java", choices=["java", "python"],
+                        help="'java' uses the fake heading service; 'python' detects headings in the PDF.")
+    parser.add_argument("--headings-latency", type=float, default=2.0, help="Fake heading service latency (s).")
+    parser.add_argument("--fake-port", type=int, default=0, help="Port of the fake services (0 = any free port).")
+    parser.add_argument("--output", help="Write the full report as JSON to this file.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    result = asyncio.run(run_benchmark(arguments))
+    print("\n" + json.dumps({key: result[key] for key in ("accuracy", "scheduler", "peak_rss_mb")}, indent=2))
+    if arguments.output:
+        Path(arguments.output).write_text(json.dumps(result, indent=2), encoding="utf-8")
@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+import contextvars
+from typing import Callable, Awaitable, Optional
+
+from observability import GEMINI_CALLS, GEMINI_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# --- Scheduler Configuration ---
+# Maximum Gemini calls in flight across all models and endpoints of this process.
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "5"))
+GEMINI_BACKOFF_BASE = float(os.environ.get("GEMINI_BACKOFF_BASE", "1.0"))
+GEMINI_BACKOFF_MAX = float(os.environ.get("GEMINI_BACKOFF_MAX", "60"))
+
+# Requests per minute and concurrent calls per model. Override with a JSON object in
+# GEMINI_MODEL_LIMITS, e.g. '{"gemini-2.5-pro": {"rpm": 60, "concurrency": 2}}'.
+DEFAULT_MODEL_LIMITS = {
+    "gemini-2.5-flash": {"rpm": 600, "concurrency": 8},
+    "gemini-2.5-pro": {"rpm": 120, "concurrency": 4},
+}
+FALLBACK_MODEL_LIMITS = {"rpm": 60, "concurrency": 2}
+MODEL_LIMITS = {**DEFAULT_MODEL_LIMITS, **json.loads(os.environ.get("GEMINI_MODEL_LIMITS", "{}"))}
+
+# Lower value = served first. Books that are already verifying finish before new
+# books start discovery.
+PRIORITY_VERIFICATION = 0
+PRIORITY_MATCH = 1
+PRIORITY_DISCOVERY = 2
+
+_RETRYABLE_MARKERS = (
+    "429", "resource_exhausted", "resource exhausted", "quota", "rate limit",
+    "503", "deadline exceeded", "unavailable", "internal error",
+)
+
+_book_counter = itertools.count()
+# Sequence number of the book the current task works on; older books win ties.
+_book_sequence = contextvars.ContextVar("gemini_book_sequence", default=None)
+
+
+def begin_book() -> int:
+    """
+    Marks the current task (and every task it spawns) as working on a new book.
+    Calls made for older books are served before calls for newer ones of the same stage.
+    """
+    sequence = next(_book_counter)
+    _book_sequence.set(sequence)
+    return sequence
+
+
+class PrioritySemaphore:
+    """A semaphore whose waiters are woken in priority order instead of FIFO."""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority) -> None:
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # We were granted the slot while being cancelled; pass it on.
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self._value += 1
+
+
+class TokenBucket:
+    """
+    Requests-per-minute limiter. Like PrioritySemaphore, waiting callers get tokens in
+    priority order instead of FIFO. `pause()` blocks all callers for a while, which is
+    used when the API answers with a quota error.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._waiters = []
+        self._counter = itertools.count()
+        self._timer = None
+
+    def pause(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def paused(self) -> bool:
+        return time.monotonic() < self.blocked_until
+
+    def _refill(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    async def acquire(self, priority) -> None:
+        now = self._refill()
+        if not self._waiters and now >= self.blocked_until and self.tokens >= 1:
+            self.tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # We were given a token while being cancelled; pass it on.
+                self.tokens += 1
+                self._dispatch()
+            raise
+
+    def _dispatch(self) -> None:
+        """Hands out the available tokens to the best-ranked waiters."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = self._refill()
+        while self._waiters and now >= self.blocked_until and self.tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.tokens -= 1
+                future.set_result(True)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        """Wakes `_dispatch` when the next token is due or the pause ends."""
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if not self._waiters or self._timer is not None:
+            return
+        now = self._refill()
+        delay = self.blocked_until - now if now < self.blocked_until else max(0.0, (1 - self.tokens) / self.rate)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return "429" in text or "resource_exhausted" in text or "resourceexhausted" in text or "quota" in text
+
+
+def is_retryable(error: Exception) -> bool:
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    if "timeout" in text or "deadlineexceeded" in text or "serviceunavailable" in text:
+        return True
+    return any(marker in text for marker in _RETRYABLE_MARKERS)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """The server-suggested delay from a Retry-After header, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class GeminiScheduler:
+    """
+    Process-wide gate for every Gemini call: a global priority-ordered concurrency cap,
+    per-model concurrency caps and requests-per-minute token buckets, and retries with
+    jittered exponential backoff that honour 429 quota errors.
+    """
+
+    def __init__(self):
+        self._global = None
+        self._models = {}
+        self.retries = {}
+        self.rate_limited = {}
+
+    def _model_gates(self, model_name: str):
+        gates = self._models.get(model_name)
+        if gates is None:
+            limits = {**FALLBACK_MODEL_LIMITS, **MODEL_LIMITS.get(model_name, {})}
+            gates = (PrioritySemaphore(int(limits["concurrency"])), TokenBucket(float(limits["rpm"])))
+            self._models[model_name] = gates
+        return gates
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": spreads retries of concurrent callers instead of syncing them.
+        return random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * (2 ** attempt)))
+
+    async def _admit(self, model_semaphore: PrioritySemaphore, bucket: TokenBucket, rank) -> None:
+        """
+        Waits for a request token of the model (sitting out any quota pause), then for
+        a model slot, and only then for a global slot, each in `rank` order. No slot is
+        held during a pause, so a model that hit its quota cannot stall calls to other
+        models.
+        """
+        while True:
+            await bucket.acquire(rank)
+            await model_semaphore.acquire(rank)
+            if bucket.paused():
+                # A quota error arrived while this call waited for the model slot.
+                model_semaphore.release()
+                continue
+            try:
+                await self._global.acquire(rank)
+            except BaseException:
+                model_semaphore.release()
+                raise
+            return
+
+    async def call(self, model_name: str, fn: Callable[[], Awaitable], priority: int = PRIORITY_DISCOVERY):
+        """
+        Runs `fn` (one Gemini request) once admitted for `model_name`, retrying
+        retryable failures. The last error is re-raised when retries are exhausted.
+        """
+        if self._global is None:
+            self._global = PrioritySemaphore(GEMINI_MAX_CONCURRENCY)
+        model_semaphore, bucket = self._model_gates(model_name)
+        book = _book_sequence.get()
+        rank = (priority, book if book is not None else float("inf"))
+
+        for attempt in range(GEMINI_MAX_RETRIES):
+            await self._admit(model_semaphore, bucket, rank)
+            try:
+                result = await fn()
+                GEMINI_CALLS.labels(model_name, "ok").inc()
+                return result
+            except Exception as e:
+                if not is_retryable(e) or attempt + 1 >= GEMINI_MAX_RETRIES:
+                    GEMINI_CALLS.labels(model_name, "failed").inc()
+                    raise
+                delay = retry_after_seconds(e) or self._backoff(attempt)
+                rate_limited = is_rate_limited(e)
+                if rate_limited:
+                    self.rate_limited[model_name] = self.rate_limited.get(model_name, 0) + 1
+                    # Everyone using this model backs off, not just this caller.
+                    bucket.pause(delay)
+                self.retries[model_name] = self.retries.get(model_name, 0) + 1
+                GEMINI_RETRIES.labels(model_name, "rate_limited" if rate_limited else "error").inc()
+                logger.warning("Gemini call to %s failed (attempt %d): %s. Retrying in %.1fs.",
+                               model_name, attempt + 1, e, delay)
+            finally:
+                self._global.release()
+                model_semaphore.release()
+            await asyncio.sleep(delay)
+
+
+scheduler = GeminiScheduler()
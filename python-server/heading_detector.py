@@ -0,0 +1,225 @@
+import os
+import re
+import asyncio
+import logging
+from collections import deque
+from typing import List, Optional
+
+import pymupdf
+
+import render_pool
+from observability import track_stage
+
+# --- Heading Detection Configuration ---
+# Pages read by one worker task. Tasks run in parallel on the render worker pool and
+# their pages are classified in document order as soon as each task is done.
+HEADING_PAGES_PER_TASK = int(os.environ.get("HEADING_PAGES_PER_TASK", "32"))
+# Tasks of one book submitted to the pool at a time. The pool is shared with page
+# rendering, which is on the TOC branch's critical path and must not queue behind
+# a whole book's worth of text extraction.
+HEADING_TASKS_IN_FLIGHT = int(os.environ.get("HEADING_TASKS_IN_FLIGHT", "2"))
+
+# Bump whenever the detection rules change so cached book results are recomputed.
+HEADING_DETECTOR_VERSION = "1"
+
+logger = logging.getLogger(__name__)
+
+# The rules below follow PdfHeadingDetectionService and PdfInfoController in the Java
+# service, so the matcher sees the same kind of {title, pageNumber, level} candidates.
+
+# Font size, page height and whitespace assumed for bookmarks, which have no layout.
+_OUTLINE_FONT_SIZE = 14.0
+_OUTLINE_PAGE_HEIGHT = 800.0
+_OUTLINE_WHITESPACE = 100.0
+# Whitespace assumed above the first line of a page.
+_FIRST_LINE_WHITESPACE = 100.0
+
+_PAGE_LABEL = re.compile(r"^page0*\d+$", re.IGNORECASE)
+_HEADING = re.compile(r"^(CHAPTER|SECTION|PART|UNIT)\s+([0-9]+|[IVXLCDM]+)?(\s*[:\-].*)?$", re.IGNORECASE)
+_CHAPTER = re.compile(r"^(CHAPTER|SECTION|PART|UNIT)\s+([0-9]+|[IVXLCDM]+)(\s*[:\-].*)?$", re.IGNORECASE)
+_CAPITALIZED = re.compile(r"^[A-Z][A-Za-z0-9 ,:;\-]{0,80}$")
+_BACK_MATTER = re.compile(r"^(APPENDIX|GLOSSARY|BIBLIOGRAPHY|INDEX|REFERENCES|ACKNOWLEDGMENTS?)($|[ .:,-])")
+_KEYWORDS = ("prologue", "epilogue", "introduction", "preface", "foreword")
+
+
+def _starts_with_keyword(text: str) -> bool:
+    lower = text.lower()
+    return any(lower == keyword or lower.startswith(keyword + " ") for keyword in _KEYWORDS)
+
+
+def is_probable_heading(text: str, font_size: float, y: float, page_height: float,
+                        whitespace_above: float, average_font_size: float, bold: bool) -> bool:
+    """First, deliberately loose pass: keeps any line that could be a heading."""
+    if not text or _PAGE_LABEL.match(text):
+        return False
+    if _HEADING.match(text) or _starts_with_keyword(text):
+        return True
+    if text == text.upper() and len(text.split()) <= 14 and len(text) > 2:
+        return True
+    if (bold or font_size >= average_font_size) and y < page_height * 0.50:
+        return True
+    if whitespace_above > 8 and (font_size >= average_font_size - 1 or bold):
+        return True
+    if font_size >= average_font_size + 2:
+        return True
+    if _CAPITALIZED.match(text) and y < page_height * 0.60:
+        return True
+    return bool(_BACK_MATTER.match(text))
+
+
+def is_chapter_heading(heading: dict, average_font_size: float) -> bool:
+    """Second pass over the candidates, with the average font size of all candidates."""
+    text = heading["title"]
+    if _CHAPTER.match(text) or _starts_with_keyword(text):
+        return True
+    if text == text.upper() and len(text.split()) <= 8:
+        return True
+    return heading["font_size"] >= average_font_size + 2 and heading["y"] < heading["page_height"] * 0.25
+
+
+def read_outline(pdf_path: str) -> dict:
+    """
+    Runs in a worker process: the page count and the top-level bookmarks as
+    (title, 1-based page or -1) pairs.
+    """
+    with pymupdf.open(pdf_path) as document:
+        outline = [(title.strip(), page) for level, title, page, *_ in document.get_toc(simple=True) if level == 1]
+        return {"page_count": document.page_count, "outline": outline}
+
+
+def read_page_lines(pdf_path: str, first_page: int, last_page: int) -> List[dict]:
+    """
+    Runs in a worker process: returns {"height", "lines"} for each page of the 1-based,
+    inclusive range, with the text lines in reading order. Like the Java service, a
+    line's font size, boldness and baseline are taken from its first span.
+    """
+    pages = []
+    with pymupdf.open(pdf_path) as document:
+        for index in range(first_page - 1, min(last_page, document.page_count)):
+            page = document[index]
+            lines = []
+            for block in page.get_text("dict", flags=pymupdf.TEXTFLAGS_TEXT, sort=True)["blocks"]:
+                for line in block.get("lines", []):
+                    text = "".join(span["text"] for span in line["spans"]).strip()
+                    spans = [span for span in line["spans"] if span["text"].strip()]
+                    if not text or not spans:
+                        continue
+                    first = spans[0]
+                    font = first["font"].lower()
+                    lines.append({
+                        "text": text,
+                        "font_size": round(first["size"], 2),
+                        "bold": bool(first["flags"] & pymupdf.TEXT_FONT_BOLD) or "bold" in font or "black" in font,
+                        "y": first["origin"][1],
+                    })
+            pages.append({"height": page.rect.height, "lines": lines})
+    return pages
+
+
+class HeadingDetector:
+    """
+    Collects heading candidates page by page. The running average font size depends on
+    every earlier line, so pages must be added in document order.
+    """
+
+    def __init__(self):
+        self.candidates = []
+        self._font_size_total = 0.0
+        self._line_count = 0
+        self._pages_with_fallback = set()
+        self._last_y = None
+        self._last_page = None
+
+    def add_outline(self, outline) -> None:
+        for title, page in outline:
+            if is_probable_heading(title, _OUTLINE_FONT_SIZE, 0, _OUTLINE_PAGE_HEIGHT, _OUTLINE_WHITESPACE,
+                                   _OUTLINE_FONT_SIZE, False):
+                self._add(title, page, _OUTLINE_FONT_SIZE, 0, _OUTLINE_PAGE_HEIGHT)
+
+    def add_page(self, page_number: int, page: dict) -> None:
+        height = page["height"]
+        for line in page["lines"]:
+            text, font_size, bold, y = line["text"], line["font_size"], line["bold"], line["y"]
+            whitespace_above = abs(y - self._last_y) if self._last_page == page_number else _FIRST_LINE_WHITESPACE
+            self._font_size_total += font_size
+            self._line_count += 1
+            average = self._font_size_total / self._line_count
+
+            probable = is_probable_heading(text, font_size, y, height, whitespace_above, average, bold)
+            # The first prominent line near the top of each page is always a candidate.
+            fallback = False
+            if page_number not in self._pages_with_fallback and (bold or font_size >= average) and y < height * 0.33:
+                fallback = True
+                self._pages_with_fallback.add(page_number)
+            if probable or fallback:
+                self._add(text, page_number, font_size, y, height)
+            self._last_y = y
+            self._last_page = page_number
+
+    def _add(self, title: str, page: int, font_size: float, y: float, page_height: float) -> None:
+        self.candidates.append({"title": title, "page": page, "font_size": font_size, "y": y, "page_height": page_height})
+
+    def chapter_headings(self) -> List[dict]:
+        """The {title, pageNumber, level} entries; level 1 means 2pt or more above the average size."""
+        if not self.candidates:
+            return []
+        average = sum(candidate["font_size"] for candidate in self.candidates) / len(self.candidates)
+        return [
+            {
+                "title": candidate["title"],
+                "pageNumber": candidate["page"],
+                "level": 1 if candidate["font_size"] >= average + 2 else 0,
+            }
+            for candidate in self.candidates
+            if is_chapter_heading(candidate, average)
+        ]
+
+
+async def iter_pages(pdf_path: str, page_count: int, pages_per_task: Optional[int] = None):
+    """
+    Yields (page number, page) in document order. At most HEADING_TASKS_IN_FLIGHT chunks
+    are in the worker pool at once; each is handed on as soon as it and every earlier
+    chunk are done, and the next chunk is submitted in its place.
+    """
+    pages_per_task = max(1, pages_per_task or HEADING_PAGES_PER_TASK)
+    loop = asyncio.get_running_loop()
+    executor = render_pool.get_executor()
+    chunk_starts = iter(range(1, page_count + 1, pages_per_task))
+    pending = deque()
+
+    def submit_next() -> None:
+        first = next(chunk_starts, None)
+        if first is not None:
+            last = min(first + pages_per_task - 1, page_count)
+            pending.append(loop.run_in_executor(executor, read_page_lines, pdf_path, first, last))
+
+    for _ in range(max(1, HEADING_TASKS_IN_FLIGHT)):
+        submit_next()
+    try:
+        page_number = 1
+        while pending:
+            pages = await pending.popleft()
+            submit_next()
+            for page in pages:
+                yield page_number, page
+                page_number += 1
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def detect_headings(pdf_path: str) -> List[dict]:
+    """
+    In-process replacement for the Java heading service: returns the same
+    {title, pageNumber, level} entries, in document order.
+    """
+    loop = asyncio.get_running_loop()
+    with track_stage("heading_detect"):
+        info = await loop.run_in_executor(render_pool.get_executor(), read_outline, pdf_path)
+        detector = HeadingDetector()
+        detector.add_outline(info["outline"])
+        async for page_number, page in iter_pages(pdf_path, info["page_count"]):
+            detector.add_page(page_number, page)
+        headings = detector.chapter_headings()
+    logger.debug("Detected %d headings on %d pages.", len(headings), info["page_count"])
+    return headings
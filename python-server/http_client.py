@@ -0,0 +1,51 @@
+import os
+from urllib.parse import urlsplit
+
+import httpx
+
+# --- HTTP Client Configuration ---
+# Limits apply per upstream host; every host gets its own keep-alive pool.
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+# Time allowed for acquiring a connection from a saturated pool.
+HTTP_POOL_TIMEOUT = float(os.environ.get("HTTP_POOL_TIMEOUT", "60"))
+
+_clients = {}
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """
+    Returns the shared, connection-pooled async client for the host of `url`.
+    Clients are created lazily and reused for the lifetime of the process.
+    """
+    key = _host_key(url)
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(HTTP_CONNECT_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT),
+        )
+        _clients[key] = client
+    return client
+
+
+def request_timeout(read_timeout: float) -> httpx.Timeout:
+    """Builds a per-call timeout that keeps the shared connect/pool limits."""
+    return httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+
+
+async def close_clients() -> None:
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
@@ -0,0 +1,137 @@
+import io
+import os
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageChops
+
+# --- Image Preprocessing Configuration ---
+# Every rendered page goes through these steps before it is sent to Gemini. Setting a
+# flag to 0 disables that step; pages are always sent as JPEG.
+IMAGE_GRAYSCALE = os.environ.get("IMAGE_GRAYSCALE", "1") != "0"
+# Longest side in pixels after resizing; 0 keeps the rendered size.
+IMAGE_MAX_LONG_EDGE = int(os.environ.get("IMAGE_MAX_LONG_EDGE", "1600"))
+IMAGE_TRIM_MARGINS = os.environ.get("IMAGE_TRIM_MARGINS", "1") != "0"
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "80"))
+SKIP_BLANK_PAGES = os.environ.get("SKIP_BLANK_PAGES", "1") != "0"
+SKIP_DUPLICATE_PAGES = os.environ.get("SKIP_DUPLICATE_PAGES", "1") != "0"
+# A page whose share of ink pixels is below this is treated as blank (a single short
+# line of body text is roughly 0.0007).
+BLANK_PAGE_MAX_INK = float(os.environ.get("BLANK_PAGE_MAX_INK", "0.0002"))
+# Share of differing pixels between two page signatures below which the later page is
+# treated as a repeat of the earlier one. Kept strict: two contents pages with the same
+# layout must never be mistaken for each other.
+DUPLICATE_PAGE_MAX_DIFF = float(os.environ.get("DUPLICATE_PAGE_MAX_DIFF", "0.0002"))
+
+# Grayscale level below which a pixel counts as ink.
+INK_LEVEL = 160
+# White border kept around the trimmed content, as a fraction of the page's long edge.
+TRIM_PADDING = 0.02
+# Pages are compared at this size; differences of less than DIFF_LEVEL grey levels are noise.
+SIGNATURE_SIZE = (362, 512)
+DIFF_LEVEL = 32
+
+# Identifies the preprocessing settings; model results for differently prepared images are not reused.
+IMAGE_PREP_VERSION = "|".join(str(value) for value in (
+    "1", IMAGE_GRAYSCALE, IMAGE_MAX_LONG_EDGE, IMAGE_TRIM_MARGINS, IMAGE_JPEG_QUALITY,
+    SKIP_BLANK_PAGES, BLANK_PAGE_MAX_INK, SKIP_DUPLICATE_PAGES, DUPLICATE_PAGE_MAX_DIFF,
+))
+
+
+def ink_mask(gray: Image.Image) -> Image.Image:
+    """A 1-bit-like mask: 255 where the page has ink, 0 on the background."""
+    return gray.point(lambda value: 255 if value < INK_LEVEL else 0)
+
+
+def ink_ratio(mask: Image.Image) -> float:
+    histogram = mask.histogram()
+    total = mask.width * mask.height
+    return histogram[255] / total if total else 0.0
+
+
+def page_signature(gray: Image.Image) -> Image.Image:
+    """A reduced copy used to spot repeated pages (e.g. running-head-only versos, repeated plates)."""
+    return gray.resize(SIGNATURE_SIZE, Image.BILINEAR)
+
+
+def is_duplicate(signature: Image.Image, previous: List[Image.Image]) -> bool:
+    total = signature.width * signature.height
+    for other in previous:
+        changed = ImageChops.difference(signature, other).point(lambda value: 255 if value > DIFF_LEVEL else 0)
+        if changed.histogram()[255] / total < DUPLICATE_PAGE_MAX_DIFF:
+            return True
+    return False
+
+
+def trim_margins(image: Image.Image, mask: Image.Image) -> Image.Image:
+    """Crops the page to its inked area plus a small padding."""
+    bbox = mask.getbbox()
+    if bbox is None:
+        return image
+    padding = int(max(image.size) * TRIM_PADDING)
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(0, left - padding),
+        max(0, top - padding),
+        min(image.width, right + padding),
+        min(image.height, bottom + padding),
+    ))
+
+
+def resize_long_edge(image: Image.Image, max_long_edge: int) -> Image.Image:
+    long_edge = max(image.size)
+    if max_long_edge <= 0 or long_edge <= max_long_edge:
+        return image
+    scale = max_long_edge / long_edge
+    return image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+
+
+def encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def prepare_image(image: Image.Image, seen_signatures: List[Image.Image]) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Preprocesses one page. Returns (JPEG bytes, None), or (None, reason) when the page
+    is skipped as "blank" or "duplicate". Signatures of kept pages are appended to
+    `seen_signatures`.
+    """
+    gray = image.convert("L")
+    mask = ink_mask(gray) if (SKIP_BLANK_PAGES or IMAGE_TRIM_MARGINS) else None
+    if SKIP_BLANK_PAGES and ink_ratio(mask) < BLANK_PAGE_MAX_INK:
+        return None, "blank"
+    if SKIP_DUPLICATE_PAGES:
+        signature = page_signature(gray)
+        if is_duplicate(signature, seen_signatures):
+            return None, "duplicate"
+        seen_signatures.append(signature)
+
+    prepared = gray if IMAGE_GRAYSCALE else image
+    if IMAGE_TRIM_MARGINS:
+        prepared = trim_margins(prepared, mask)
+    prepared = resize_long_edge(prepared, IMAGE_MAX_LONG_EDGE)
+    return encode_jpeg(prepared, IMAGE_JPEG_QUALITY), None
+
+
+def prepare_images(images: List[Image.Image]) -> dict:
+    """
+    Preprocesses the pages of one model request. Returns:
+      * "parts":   inline JPEG blobs for the kept pages, in order
+      * "bytes":   total image bytes that will be sent
+      * "skipped": {"blank": n, "duplicate": n}
+    """
+    parts = []
+    total_bytes = 0
+    skipped = {"blank": 0, "duplicate": 0}
+    seen_signatures = []
+    for image in images:
+        data, reason = prepare_image(image, seen_signatures)
+        if data is None:
+            skipped[reason] += 1
+            continue
+        parts.append({"mime_type": "image/jpeg", "data": data})
+        total_bytes += len(data)
+    return {"parts": parts, "bytes": total_bytes, "skipped": skipped}
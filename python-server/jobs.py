@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import sqlite3
+import threading
+from typing import Callable, Awaitable, Optional, List
+
+# --- Job Configuration ---
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join("cache", "jobs.sqlite3"))
+# Uploaded PDFs wait here until their job has run.
+JOB_FILES_DIR = os.environ.get("JOB_FILES_DIR", os.path.join("cache", "job_files"))
+# How long finished jobs (and their results) can still be fetched.
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", str(24 * 3600)))
+# Jobs processed at the same time by this worker process.
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", "2"))
+# Queued jobs beyond which new submissions are refused with 503.
+JOB_MAX_QUEUED = int(os.environ.get("JOB_MAX_QUEUED", "100"))
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Identifies this worker process. PIDs are reused, e.g. a restarted container usually
+# gets the same PID as before, so job ownership is keyed on this id.
+BOOT_ID = uuid.uuid4().hex
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT,
+    pdf_path TEXT,
+    pdf_digest TEXT,
+    stages TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    owner_pid INTEGER,
+    owner_boot TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+)
+"""
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """
+    Jobs persisted in a local SQLite database, shared by all worker processes on the
+    host and kept across restarts. Every call is a short single-row statement.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(_SCHEMA)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "owner_boot" not in columns:
+                # Databases created before owner_boot existed.
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN owner_boot TEXT")
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def create(self, filename: str, pdf_path: str, pdf_digest: str) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, status, filename, pdf_path, pdf_digest, owner_pid, owner_boot, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, QUEUED, filename, pdf_path, pdf_digest, os.getpid(), BOOT_ID, now, now),
+        )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def set_stage(self, job_id: str, stage: str, status: str) -> None:
+        """Records a stage transition with its timestamp in the job's `stages` JSON."""
+        with self._lock:
+            row = self._conn.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            stages = json.loads(row["stages"])
+            now = time.time()
+            entry = stages.setdefault(stage, {})
+            entry["status"] = status
+            if status == "running":
+                entry["started_at"] = now
+            elif status in ("done", "failed"):
+                entry["finished_at"] = now
+            self._conn.execute(
+                "UPDATE jobs SET stages = ?, updated_at = ? WHERE id = ?", (json.dumps(stages), now, job_id)
+            )
+
+    def count(self, status: str) -> int:
+        return self._execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def claim_orphans(self) -> List[dict]:
+        """
+        Takes over queued or running jobs whose worker process is gone (e.g. after a
+        restart) so they can be run again by this process. A job is orphaned unless it
+        belongs to this process (same BOOT_ID) or to another live process on the host;
+        a job left by an earlier process that had our PID is orphaned too.
+        """
+        claimed = []
+        rows = self._execute(
+            "SELECT id, owner_pid, owner_boot FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+        ).fetchall()
+        for row in rows:
+            if row["owner_boot"] == BOOT_ID:
+                continue
+            if row["owner_pid"] != os.getpid() and _pid_alive(row["owner_pid"]):
+                continue
+            cursor = self._execute(
+                "UPDATE jobs SET owner_pid = ?, owner_boot = ?, status = ?, updated_at = ? "
+                "WHERE id = ? AND owner_boot IS ?",
+                (os.getpid(), BOOT_ID, QUEUED, time.time(), row["id"], row["owner_boot"]),
+            )
+            if cursor.rowcount:
+                claimed.append(self.get(row["id"]))
+        return claimed
+
+    def purge_expired(self, retention_seconds: int) -> List[dict]:
+        """Deletes finished jobs older than the retention period; returns the deleted rows."""
+        cutoff = time.time() - retention_seconds
+        rows = self._execute(
+            "SELECT * FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (COMPLETED, FAILED, cutoff)
+        ).fetchall()
+        if rows:
+            self._execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (COMPLETED, FAILED, cutoff)
+            )
+        return [dict(row) for row in rows]
+
+
+def is_expired(job: dict, retention_seconds: Optional[int] = None) -> bool:
+    """True for finished jobs past the retention period that have not been purged yet."""
+    retention_seconds = JOB_RETENTION_SECONDS if retention_seconds is None else retention_seconds
+    return job["finished_at"] is not None and job["finished_at"] < time.time() - retention_seconds
+
+
+def job_to_dict(job: dict) -> dict:
+    """The public view of a job as returned by GET /jobs/{id}."""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "stages": json.loads(job["stages"] or "{}"),
+        "result": json.loads(job["result"]) if job["result"] else None,
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+class JobRunner:
+    """
+    Runs stored jobs in the background of the event loop, at most JOB_CONCURRENCY at a
+    time. `process_fn(pdf_path, pdf_digest, on_progress)` runs the book pipeline.
+    """
+
+    def __init__(self, store: JobStore, concurrency: int):
+        self.store = store
+        self.concurrency = max(1, concurrency)
+        self._semaphore = None
+        self._tasks = set()
+
+    def start(self, job_id: str, process_fn: Callable[..., Awaitable[dict]]) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        task = asyncio.create_task(self._run(job_id, process_fn), name=f"job-{job_id[:8]}")
+        # Keep a reference so the task is not garbage collected while it runs.
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job_id: str, process_fn: Callable[..., Awaitable[dict]]) -> None:
+        async with self._semaphore:
+            job = self.store.get(job_id)
+            if job is None or job["status"] != QUEUED:
+                return
+            self.store.update(job_id, status=RUNNING)
+            logger.info("[JOB %s] Processing %s", job_id[:8], job["filename"])
+            try:
+                result = await process_fn(
+                    job["pdf_path"], job["pdf_digest"], lambda stage, status: self.store.set_stage(job_id, stage, status)
+                )
+                # The pipeline's stages log their errors and carry on, so a failed
+                # extraction arrives as an error payload or an empty TOC.
+                if not isinstance(result, dict):
+                    raise RuntimeError("pipeline returned no result")
+                if "error" in result:
+                    raise RuntimeError(result["error"])
+                if not result.get("toc"):
+                    raise RuntimeError("pipeline produced an empty TOC")
+                self.store.update(job_id, status=COMPLETED, result=json.dumps(result), finished_at=time.time())
+                logger.info("[JOB %s] Completed", job_id[:8])
+            except Exception as e:
+                logger.exception("[JOB %s] Failed: %s", job_id[:8], e)
+                self.store.update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+            finally:
+                _remove_file(job["pdf_path"])
+
+    def recover(self, process_fn: Callable[..., Awaitable[dict]]) -> int:
+        """Restarts jobs left unfinished by a worker process that is no longer running."""
+        recovered = 0
+        for job in self.store.claim_orphans():
+            if job["pdf_path"] and os.path.exists(job["pdf_path"]):
+                self.start(job["id"], process_fn)
+                recovered += 1
+            else:
+                self.store.update(job["id"], status=FAILED, error="Uploaded PDF was lost before the job ran.",
+                                  finished_at=time.time())
+        if recovered:
+            logger.info("Resumed %d unfinished jobs.", recovered)
+        return recovered
+
+    def purge(self) -> int:
+        expired = self.store.purge_expired(JOB_RETENTION_SECONDS)
+        for job in expired:
+            _remove_file(job["pdf_path"])
+        return len(expired)
+
+
+def _remove_file(path: Optional[str]) -> None:
+    if path and os.path.exists(path):
+        os.unlink(path)
+
+
+store = None
+runner = None
+
+
+def get_runner() -> JobRunner:
+    """The process-wide runner; the SQLite store is opened on first use."""
+    global store, runner
+    if runner is None:
+        store = JobStore(JOB_DB_PATH)
+        runner = JobRunner(store, JOB_CONCURRENCY)
+    return runner
@@ -2,20 +2,124 @@
 # --- BEGIN: Integrated image-based TOC extraction logic ---
 import re
 import os
-import requests
-import tempfile
+import asyncio
 import json
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse
+import uuid
+import shutil
+import logging
+import tempfile
+from typing import List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
 # Remove PyPDF2 import, not needed for new workflow
 
 # Import the new TOC extraction logic
 import toc_logic
+import toc_matcher
+import heading_detector
+import gemini_scheduler
+from result_cache import result_cache, make_key, sha256_file
+from http_client import get_client, request_timeout, close_clients
+from pipeline import Stage, ProgressBroadcast, run_stages
+from observability import setup_logging, track_stage, record_payload, render_metrics
+import admission
+import batch
+import jobs
+import render_pool
+import uploads
+
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
 # Read Gemini API key from env var, fallback to empty string if not set
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+# Base URL of the Gemini REST API used by the final match call.
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+
+MATCH_MODEL = "gemini-2.5-flash"
+# Bump whenever the wording of the final matching prompt changes so cached results are recomputed.
+MATCH_PROMPT_VERSION = "2"
+
+# Where heading candidates come from: "python" detects them in-process (heading_detector)
+# and only falls back to the remote service when the PDF yields none (e.g. a scan without
+# a text layer, which the Java service OCRs); "java" always uses the remote heading
+# service at JAVA_HEADINGS_URL.
+HEADINGS_BACKEND = os.environ.get("HEADINGS_BACKEND", "python").lower()
+JAVA_HEADINGS_URL = os.environ.get(
+    "JAVA_HEADINGS_URL",
+    "https://dependable-expression-production-3af1.up.railway.app/get/pdf-info/detect-chapter-headings",
+)
+# Read timeouts (seconds) for the two upstream calls.
+JAVA_HEADINGS_TIMEOUT = float(os.environ.get("JAVA_HEADINGS_TIMEOUT", "180"))
+GEMINI_MATCH_TIMEOUT = float(os.environ.get("GEMINI_MATCH_TIMEOUT", "300"))
+
+# Response formats of the streaming mode of /process-pdf (`?stream=ndjson|sse`).
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+@app.on_event("startup")
+async def resume_jobs():
+    runner = jobs.get_runner()
+    runner.purge()
+    runner.recover(get_book_analysis)
+
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    await close_clients()
+    render_pool.shutdown()
+
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """
+    Book requests wait for one of MAX_ACTIVE_REQUESTS slots before their upload is read.
+    When MAX_QUEUED_REQUESTS are already waiting, answer 503 with a Retry-After estimate
+    right away instead of slowing every request down.
+    """
+    if request.method != "POST" or request.url.path not in admission.ADMITTED_PATHS:
+        return await call_next(request)
+    try:
+        started = await admission.controller.acquire()
+    except admission.Saturated as e:
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)},
+            content={"error": "Server is busy, please retry later.", "retry_after": e.retry_after},
+        )
+    try:
+        response = await call_next(request)
+    except BaseException:
+        admission.controller.release(started)
+        raise
+    # Streamed responses keep running the pipeline after call_next returns.
+    response.body_iterator = admission.controller.hold_until_sent(response.body_iterator, started)
+    return response
+
+
+# Registered after admission_control so it runs first: oversized uploads are refused
+# before they wait for a slot or have their body read.
+@app.middleware("http")
+async def upload_size_limit(request: Request, call_next):
+    """
+    Answers 413 when the declared Content-Length cannot fit within MAX_UPLOAD_BYTES.
+    Bodies without one are cut off while they are read (see uploads.receive_pdf_upload).
+    """
+    content_length = request.headers.get("content-length")
+    if request.method == "POST" and content_length and content_length.isdigit():
+        if int(content_length) > uploads.MAX_UPLOAD_BYTES + uploads.MULTIPART_OVERHEAD_BYTES:
+            return upload_error_response(uploads.UploadTooLarge(uploads.MAX_UPLOAD_BYTES))
+    return await call_next(request)
+
+
+def upload_error_response(e: uploads.UploadError) -> JSONResponse:
+    content = {"error": str(e)}
+    if isinstance(e, uploads.UploadTooLarge):
+        content["max_bytes"] = e.max_bytes
+    return JSONResponse(status_code=e.status_code, content=content)
 
 # This is a fallback parser if Gemini returns markdown instead of JSON
 def parse_chapter_list(text_response):
@@ -29,54 +133,137 @@ def parse_chapter_list(text_response):
         })
     return chapters
 
-async def get_toc_from_new_logic(pdf_path: str):
+async def on_own_copy(pdf_path: str, compute):
+    """
+    Runs `compute(path)` on a hard link (or copy) of `pdf_path` that is removed once it is
+    done. Shared cache computations run on for the other waiters when the request that
+    started them goes away, and every request removes its own upload when it ends.
+    """
+    own_path = os.path.join(tempfile.gettempdir(), f"shared-{uuid.uuid4().hex}.pdf")
+    try:
+        # Linked (or opened) before the first await, i.e. before the request that started
+        # the computation can resume and remove its upload.
+        try:
+            os.link(pdf_path, own_path)
+        except OSError:
+            with open(pdf_path, "rb") as source, open(own_path, "wb") as target:
+                await asyncio.to_thread(shutil.copyfileobj, source, target)
+        return await compute(own_path)
+    finally:
+        if os.path.exists(own_path):
+            os.unlink(own_path)
+
+
+# Cache key -> ProgressBroadcast of the shared computation in flight for it.
+_in_flight_progress = {}
+
+
+async def get_or_compute_reporting(cache_key: str, compute, listener, should_store):
+    """
+    `result_cache.get_or_compute` for a computation that reports progress: `compute(progress)`
+    reports to a ProgressBroadcast shared by all callers waiting on it, and this caller's
+    `listener` (if any) hears about it, including what was reported before it joined.
+    """
+    progress = _in_flight_progress.setdefault(cache_key, ProgressBroadcast())
+
+    async def run():
+        progress.running = True
+        try:
+            return await compute(progress)
+        finally:
+            progress.running = False
+            if _in_flight_progress.get(cache_key) is progress:
+                del _in_flight_progress[cache_key]
+
+    if listener is not None:
+        progress.add(listener)
+    try:
+        return await result_cache.get_or_compute(cache_key, run, should_store=should_store)
+    finally:
+        if listener is not None:
+            progress.remove(listener)
+        if not progress.running and not progress.listeners and _in_flight_progress.get(cache_key) is progress:
+            # Served from the cache, nothing ran.
+            del _in_flight_progress[cache_key]
+
+
+async def get_toc_from_new_logic(pdf_path: str, pdf_digest: str, on_metadata=None):
     """
     Wrapper function to call the new image-based TOC extraction logic.
+    Results are cached on disk by PDF hash and prompt/model version.
+    `on_metadata(metadata)` is called as soon as the extraction knows the book's metadata;
+    it is not called when the result comes from the cache.
     """
-    print("[DEBUG] Starting new image-based TOC extraction from toc_logic.py")
     if not GEMINI_API_KEY:
-        print("[DEBUG] GEMINI_API_KEY not set, skipping new TOC logic.")
+        logger.warning("GEMINI_API_KEY not set, skipping TOC extraction.")
         return []
     try:
         # Call the async process_pdf function from the new module
-        result_json = await toc_logic.process_pdf(pdf_path)
+        cache_key = make_key(pdf_digest, "toc", toc_logic.PIPELINE_VERSION)
+        with track_stage("toc"):
+            result_json = await get_or_compute_reporting(
+                cache_key,
+                lambda progress: on_own_copy(pdf_path, lambda path: toc_logic.process_pdf(
+                    path, pdf_digest, on_metadata=lambda metadata: progress("metadata", metadata))),
+                listener=(lambda event, metadata: on_metadata(metadata)) if on_metadata else None,
+                should_store=lambda result: bool(result and result.get("toc_entries")),
+            )
         if result_json and "toc_entries" in result_json:
-            print("[DEBUG] Successfully extracted TOC using new image-based logic.")
             return result_json
         else:
-            print("[DEBUG] New TOC extraction logic returned no entries.")
+            logger.warning("TOC extraction returned no entries.")
             return None
     except Exception as e:
-        print(f"[DEBUG] An error occurred while running the new TOC logic: {e}")
+        logger.exception("An error occurred while running the TOC extraction: %s", e)
         return None
 
 
-def get_java_headings(pdf_path):
-    url = "https://dependable-expression-production-3af1.up.railway.app/get/pdf-info/detect-chapter-headings"
+async def get_java_headings(pdf_path):
+    url = JAVA_HEADINGS_URL
     with open(pdf_path, "rb") as f:
-        files = {"file": f}
+        files = {"file": (os.path.basename(pdf_path), f, "application/pdf")}
         try:
-            response = requests.post(url, files=files, timeout=180)
-            print("[DEBUG] Java headings API status:", response.status_code)
+            client = get_client(url)
+            with track_stage("heading_fetch"):
+                response = await client.post(url, files=files, timeout=request_timeout(JAVA_HEADINGS_TIMEOUT))
+            record_payload("headings_response", len(response.content))
+            logger.debug("Java headings API status: %d (%d bytes)", response.status_code, len(response.content))
             if response.status_code == 200:
                 headings_data = response.json()
-                print("[DEBUG] Java headings raw response:", headings_data)
                 if isinstance(headings_data, dict) and "headings" in headings_data:
                     return headings_data["headings"]
                 return headings_data
         except Exception as e:
-            print("[DEBUG] Java headings API exception:", e)
+            logger.error("Java headings API exception: %s", e)
             return {"error": str(e)}
     return []
 
 
-def match_toc_with_java_headings_gemini(toc, java_headings, book_title):
-    url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key=" + GEMINI_API_KEY
+async def get_headings(pdf_path):
+    """
+    Heading candidates as {title, pageNumber, level} entries from the configured
+    HEADINGS_BACKEND. Failures are returned as {"error": ...}, like the Java backend does.
+    """
+    if HEADINGS_BACKEND == "java":
+        return await get_java_headings(pdf_path)
+    try:
+        headings = await heading_detector.detect_headings(pdf_path)
+    except Exception as e:
+        logger.error("Heading detection failed: %s", e)
+        headings = []
+    if headings:
+        return headings
+    # No text layer or nothing heading-like in it: the Java service can still OCR the pages.
+    logger.info("No headings found in the PDF's text; falling back to the Java heading service.")
+    return await get_java_headings(pdf_path)
+
+
+async def match_toc_with_java_headings_gemini(toc, java_headings, book_title):
+    url = f"{GEMINI_API_BASE}/v1beta/models/{MATCH_MODEL}:generateContent?key=" + GEMINI_API_KEY
 
     # --- IMPORTANT CHANGE ---
     # Reformat the TOC to remove page numbers and other extra fields
     # before sending it to the final matching prompt.
-    print("[DEBUG] Raw TOC passed to final matching step:", toc)
     formatted_toc_for_prompt = [
         {
             "chapter_title": entry.get("chapter_title"),
@@ -84,7 +271,22 @@ def match_toc_with_java_headings_gemini(toc, java_headings, book_title):
         }
         for entry in toc
     ]
-    print("[DEBUG] Formatted TOC for final prompt (should NOT include page_number):", formatted_toc_for_prompt)
+
+    # Drop noise, keep the TOC's page span, merge same-page fragments and serialise
+    # without indentation: the prompt shrinks a lot for long books.
+    compact_headings = toc_matcher.compact_headings_for_prompt(java_headings, toc)
+    headings_for_prompt = json.dumps(compact_headings, separators=(",", ":"), ensure_ascii=False)
+    record_payload("match_headings_compact", len(headings_for_prompt))
+    logger.info(
+        "Match prompt headings: %d -> %d entries, %d chars",
+        len(java_headings) if isinstance(java_headings, list) else 0, len(compact_headings), len(headings_for_prompt),
+    )
+    if logger.isEnabledFor(logging.DEBUG) and isinstance(java_headings, list):
+        # What the former indented prompt would have cost; serialising the whole heading
+        # list again is only worth it when debugging.
+        raw_size = len(json.dumps(java_headings, indent=2))
+        record_payload("match_headings_raw", raw_size)
+        logger.debug("Match prompt headings before compaction: %d chars", raw_size)
 
     prompt = (
         f"You are an expert data-cleaning and text-matching AI. Your task is to create a final, accurate Table of Contents (TOC) for the book '{book_title}'.\n\n"
@@ -104,6 +306,7 @@ def match_toc_with_java_headings_gemini(toc, java_headings, book_title):
         "* **Your Strategy:** You must look for **consecutive entries** in the [JAVA HEADINGS LIST] that appear on the **same page number**.\n"
         "* When you find such a sequence, combine their 'title' fields. If the combined text matches a chapter from the [TOC LIST], you have found a match.\n"
         "* The correct page number for the chapter is the page number of the **first** entry in that sequence.\n"
+        f"* Consecutive same-page fragments have already been joined for you with '{toc_matcher.FRAGMENT_SEPARATOR.strip()}' (e.g. 'FUTURE{toc_matcher.FRAGMENT_SEPARATOR}LSD{toc_matcher.FRAGMENT_SEPARATOR}PSYCHOTHERAPY'); a chapter title may be any consecutive part of such an entry.\n"
         "**3. Use Logical Reasoning to Resolve Ambiguity:**\n"
         "* **Chronological Order is Mandatory:** Chapter page numbers MUST increase sequentially. Chapter 5 cannot start on a page that comes after Chapter 6. Use this to eliminate impossible matches.\n"
         "* **Plausible Chapter Length:** If you are unsure between two possible page numbers for a chapter, consider the page numbers of the chapters before and after it. If one choice makes the chapter only one or two pages long while all other chapters are 20 pages long, it is almost certainly the wrong choice. Select the page number that results in a more logical and balanced book structure.\n"
@@ -112,9 +315,9 @@ def match_toc_with_java_headings_gemini(toc, java_headings, book_title):
         "-----\n"
         "### YOUR INPUTS:\n"
         "**[TOC LIST]**\n"
-        + json.dumps(formatted_toc_for_prompt, indent=2) +
+        + json.dumps(formatted_toc_for_prompt, separators=(",", ":"), ensure_ascii=False) +
         "\n**[JAVA HEADINGS LIST]**\n"
-        + json.dumps(java_headings, indent=2) +
+        + headings_for_prompt +
         "\n-----\n"
         "### YOUR TASK:\n"
         "Now, analyze the two lists according to the critical rules above.\n"
@@ -123,12 +326,21 @@ def match_toc_with_java_headings_gemini(toc, java_headings, book_title):
     )
     headers = {"Content-Type": "application/json"}
     data = {"contents": [{"parts": [{"text": prompt}]}]}
+    record_payload("gemini_match_request", len(prompt.encode("utf-8")))
+    client = get_client(url)
+
+    async def send():
+        response = await client.post(url, headers=headers, json=data, timeout=request_timeout(GEMINI_MATCH_TIMEOUT))
+        # Let the scheduler retry quota errors and server errors.
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
     try:
-        response = requests.post(url, headers=headers, json=data)
-        print("[DEBUG] Gemini match API status:", response.status_code)
+        response = await gemini_scheduler.scheduler.call(MATCH_MODEL, send, priority=gemini_scheduler.PRIORITY_MATCH)
+        logger.debug("Gemini match API status: %d", response.status_code)
         if response.status_code == 200:
             result = response.json()
-            print("[DEBUG] Gemini match raw response:", result)
             candidates = result.get("candidates", [])
             if candidates:
                 text_response = candidates[0]["content"]["parts"][0]["text"]
@@ -145,29 +357,207 @@ def match_toc_with_java_headings_gemini(toc, java_headings, book_title):
                     if isinstance(final_chapters, list) and final_chapters:
                         return final_chapters
                 except Exception:
-                    print("[DEBUG] Gemini match response not valid JSON:", cleaned)
+                    logger.warning("Gemini match response not valid JSON (%d chars).", len(cleaned))
                     # Try fallback parsing
                     final_chapters = parse_chapter_list(cleaned)
                     if final_chapters:
-                        print("[DEBUG] Parsed chapter list from markdown format.")
+                        logger.info("Parsed chapter list from markdown format.")
                         return final_chapters
                 # Fallback: return original TOC if Gemini output is empty or invalid
-                print("[DEBUG] Gemini output empty or invalid, returning original TOC.")
+                logger.warning("Gemini output empty or invalid, returning original TOC.")
                 return toc
         return []
     except Exception as e:
-        print("[DEBUG] Gemini match API exception:", e)
+        logger.error("Gemini match API exception: %s", e)
         return []
 
 
-@app.post("/extract-toc")
-async def extract_toc_endpoint(file: UploadFile = File(...)):
+async def match_toc_with_headings(toc, java_headings, book_title):
+    """
+    Assigns page numbers to the TOC with the local alignment engine in toc_matcher,
+    then asks Gemini only about the chapters the local match is not confident about.
+    """
+    if not toc:
+        return []
+    # The alignment is pure CPU work; keep it off the event loop.
+    aligned = await asyncio.to_thread(toc_matcher.align_toc, toc, java_headings)
+    low_indices = toc_matcher.low_confidence_indices(aligned)
+    logger.info("Local match resolved %d/%d chapters with high confidence.", len(aligned) - len(low_indices), len(aligned))
+    if not low_indices or not GEMINI_API_KEY:
+        return aligned
+
+    # Only send the uncertain chapters and the headings that could still fit between
+    # their confidently matched neighbours.
+    windows = [toc_matcher.page_window(aligned, i) for i in low_indices]
+    fallback_toc = [toc[i] for i in low_indices]
+    fallback_headings = toc_matcher.headings_in_windows(java_headings, windows)
+    fallback_chapters = await match_toc_with_java_headings_gemini(fallback_toc, fallback_headings, book_title)
+    updated = toc_matcher.apply_fallback(aligned, low_indices, fallback_chapters)
+    logger.info("Gemini fallback updated %d/%d low-confidence chapters.", updated, len(low_indices))
+    return aligned
+
+
+async def match_stage(result, java_headings):
+    """
+    Final stage: joins the TOC extraction and heading detection branches.
+    """
+    toc = result["toc_entries"] if result and "toc_entries" in result else []
+    metadata = result["metadata"] if result and "metadata" in result else {}
+    book_title = metadata.get("book_title") or "Unknown Title"
+    authors = metadata.get("authors") or ["Unknown Author"]
+    with track_stage("match", chapters=len(toc)):
+        final_chapters = await match_toc_with_headings(toc, java_headings, book_title)
+    return {
+        "book_title": book_title,
+        "authors": authors,
+        "toc": final_chapters
+    }
+
+
+def build_book_stages(pdf_path: str, pdf_digest: str) -> List[Stage]:
+    """
+    The book pipeline as a DAG: image-based TOC extraction and the heading fetch are
+    independent and run in parallel; only the final match waits for both.
+    """
+    return [
+        Stage("toc", lambda: get_toc_from_new_logic(pdf_path, pdf_digest)),
+        Stage("headings", lambda: get_headings(pdf_path)),
+        Stage("match", match_stage, deps=("toc", "headings")),
+    ]
+
+
+async def analyze_book(pdf_path: str, pdf_digest: str, on_progress=None):
+    """
+    Runs the full pipeline (TOC extraction, heading detection, final match) for one PDF.
+    `on_progress(stage, status)` is told about every stage transition.
+    """
+    # Gemini calls of this book (in every stage) are scheduled ahead of newer books.
+    gemini_scheduler.begin_book()
+    with track_stage("total"):
+        results = await run_stages(build_book_stages(pdf_path, pdf_digest), on_progress=on_progress)
+    return results["match"]
+
+
+async def get_book_analysis(pdf_path: str, pdf_digest: str, on_progress=None):
+    """
+    Cached wrapper around `analyze_book`. Concurrent uploads of the same PDF share
+    a single computation; only results with a non-empty TOC are stored. Every caller's
+    `on_progress` is told about the stages of the shared computation.
+    """
+    return await get_or_compute_reporting(
+        book_cache_key(pdf_digest),
+        lambda progress: on_own_copy(pdf_path, lambda path: analyze_book(path, pdf_digest, progress)),
+        listener=on_progress,
+        should_store=lambda result: bool(result.get("toc")),
+    )
+
+
+def book_cache_key(pdf_digest: str) -> str:
+    return make_key(
+        pdf_digest, "book", toc_logic.PIPELINE_VERSION, MATCH_MODEL, MATCH_PROMPT_VERSION,
+        toc_matcher.MATCHER_VERSION, HEADINGS_BACKEND, heading_detector.HEADING_DETECTOR_VERSION,
+    )
+
+
+async def book_events(pdf_path: str, pdf_digest: str):
+    """
+    Streaming counterpart of `get_book_analysis`: yields (event, data) pairs as soon as
+    each part of the answer is known, in this order:
+      * "metadata": title, authors and publisher details from the TOC extraction, sent
+                    as soon as the extraction knows them (for scans, before verification)
+      * "toc":      the verified TOC entries, without matched page numbers
+      * "match":    the final {book_title, authors, toc} result with page numbers
+    The heading fetch runs in parallel with the TOC extraction, as in `analyze_book`.
+    A cached book is answered from the cached result alone.
+    """
+    gemini_scheduler.begin_book()
+    cache_key = book_cache_key(pdf_digest)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        yield "metadata", {"book_title": cached.get("book_title"), "authors": cached.get("authors")}
+        yield "toc", toc_event(cached.get("toc") or [])
+        yield "match", cached
+        return
+
+    metadata_known = asyncio.get_running_loop().create_future()
+
+    def on_metadata(metadata):
+        if not metadata_known.done():
+            metadata_known.set_result(metadata)
+
+    headings_task = asyncio.create_task(get_headings(pdf_path))
+    toc_task = asyncio.create_task(get_toc_from_new_logic(pdf_path, pdf_digest, on_metadata=on_metadata))
+    try:
+        # For scanned books the metadata is known well before the verified TOC.
+        await asyncio.wait({toc_task, metadata_known}, return_when=asyncio.FIRST_COMPLETED)
+        if metadata_known.done():
+            yield "metadata", metadata_known.result()
+        result = await toc_task
+        if not metadata_known.done():
+            yield "metadata", result["metadata"] if result and "metadata" in result else {}
+        yield "toc", toc_event(result["toc_entries"] if result and "toc_entries" in result else [])
+        final_json = await match_stage(result, await headings_task)
+        if final_json.get("toc"):
+            result_cache.put(cache_key, final_json)
+        yield "match", final_json
+    finally:
+        for task in (toc_task, headings_task):
+            if not task.done():
+                task.cancel()
+
+
+def toc_event(toc: List[dict]) -> dict:
+    """The "toc" event of `book_events`: the TOC entries without page numbers."""
+    return {
+        "toc": [
+            {
+                "chapter_title": entry.get("chapter_title"),
+                "chapter_number": entry.get("chapter_number"),
+                "reference_boolean": entry.get("reference_boolean"),
+            }
+            for entry in toc
+        ]
+    }
+
+
+def format_event(event: str, data, stream_format: str) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {payload}\n\n"
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+
+async def stream_book_events(pdf_path: str, pdf_digest: str, stream_format: str):
+    """
+    Renders `book_events` in the requested format and ends the stream with an "error"
+    event on failure. Owns the uploaded temp file and removes it once the stream is done.
+    """
+    try:
+        async for event, data in book_events(pdf_path, pdf_digest):
+            yield format_event(event, data, stream_format)
+    except Exception as e:
+        logger.exception("Streaming request failed: %s", e)
+        yield format_event("error", {"error": str(e)}, stream_format)
+    finally:
+        if os.path.exists(pdf_path):
+            os.unlink(pdf_path)
+
+
+async def analyze_pdf_file(pdf_path: str):
+    """
+    Runs the cached book pipeline on a PDF that is already on disk (used by batch mode).
+    """
+    pdf_digest = await asyncio.to_thread(sha256_file, pdf_path)
+    return await get_book_analysis(pdf_path, pdf_digest)
+
+
+@app.post("/extract-toc", openapi_extra=uploads.OPENAPI_PDF_UPLOAD)
+async def extract_toc_endpoint(request: Request):
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
+        tmp_path, pdf_digest, _ = await uploads.receive_pdf_upload(request)
+        gemini_scheduler.begin_book()
         # Call the new TOC extraction logic
-        result = await get_toc_from_new_logic(tmp_path)
+        result = await get_toc_from_new_logic(tmp_path, pdf_digest)
         toc = result["toc_entries"] if result and "toc_entries" in result else []
         # Only include chapter_title and reference_boolean for each entry
         filtered_toc = [
@@ -178,7 +568,10 @@ async def extract_toc_endpoint(file: UploadFile = File(...)):
             for entry in toc
         ]
         return JSONResponse(content={"toc": filtered_toc})
+    except uploads.UploadError as e:
+        return upload_error_response(e)
     except Exception as e:
+        logger.exception("Request failed: %s", e)
         return JSONResponse(content={"error": str(e)})
     finally:
         # Clean up the temporary file
@@ -186,63 +579,159 @@ async def extract_toc_endpoint(file: UploadFile = File(...)):
             os.unlink(tmp_path)
 
 
-@app.post("/match-toc-java")
-async def match_toc_java_endpoint(
-    file: UploadFile = File(...)
-):
+@app.post("/match-toc-java", openapi_extra=uploads.OPENAPI_PDF_UPLOAD)
+async def match_toc_java_endpoint(request: Request):
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
-        # Call the new TOC extraction logic
-        result = await get_toc_from_new_logic(tmp_path)
-        toc = result["toc_entries"] if result and "toc_entries" in result else []
-        metadata = result["metadata"] if result and "metadata" in result else {}
-        book_title = metadata.get("book_title") or "Unknown Title"
-        authors = metadata.get("authors") or ["Unknown Author"]
-        java_headings = get_java_headings(tmp_path)
-        print("[DEBUG] Java headings for matching:", java_headings)
-        final_chapters = match_toc_with_java_headings_gemini(toc, java_headings, book_title) if GEMINI_API_KEY else []
-        final_json = {
-            "book_title": book_title,
-            "authors": authors,
-            "toc": final_chapters
-        }
-        print("[DEBUG] Final API response:", final_json)
+        tmp_path, pdf_digest, _ = await uploads.receive_pdf_upload(request)
+        final_json = await get_book_analysis(tmp_path, pdf_digest)
+        logger.info("Processed '%s': %d chapters.", final_json.get("book_title"), len(final_json.get("toc") or []))
         return JSONResponse(content=final_json)
+    except uploads.UploadError as e:
+        return upload_error_response(e)
     except Exception as e:
+        logger.exception("Request failed: %s", e)
         return JSONResponse(content={"error": str(e)})
     finally:
         if 'tmp_path' in locals() and os.path.exists(tmp_path):
             os.unlink(tmp_path)
 
 
-@app.post("/process-pdf")
-async def process_pdf(
-    file: UploadFile = File(...)
-):
+@app.post("/process-pdf", openapi_extra=uploads.OPENAPI_PDF_UPLOAD)
+async def process_pdf(request: Request, stream: Optional[str] = None):
+    """
+    Returns {book_title, authors, toc} once the whole pipeline has finished. With
+    `?stream=ndjson` or `?stream=sse` (or `Accept: text/event-stream`) the answer is
+    streamed instead: a "metadata" event, then "toc" with the verified entries, then
+    "match" with the final result.
+    """
+    if stream is None and "text/event-stream" in request.headers.get("accept", ""):
+        stream = "sse"
+    if stream is not None and stream not in STREAM_MEDIA_TYPES:
+        return JSONResponse(status_code=400, content={"error": "'stream' must be one of: ndjson, sse."})
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
-        # Call the new TOC extraction logic
-        result = await get_toc_from_new_logic(tmp_path)
-        toc = result["toc_entries"] if result and "toc_entries" in result else []
-        metadata = result["metadata"] if result and "metadata" in result else {}
-        book_title = metadata.get("book_title") or "Unknown Title"
-        authors = metadata.get("authors") or ["Unknown Author"]
-        java_headings = get_java_headings(tmp_path)
-        print("[DEBUG] Java headings for matching:", java_headings)
-        final_chapters = match_toc_with_java_headings_gemini(toc, java_headings, book_title) if GEMINI_API_KEY else []
-        final_json = {
-            "book_title": book_title,
-            "authors": authors,
-            "toc": final_chapters
-        }
-        print("[DEBUG] Final API response:", final_json)
+        tmp_path, pdf_digest, _ = await uploads.receive_pdf_upload(request)
+        if stream is not None:
+            response = StreamingResponse(
+                stream_book_events(tmp_path, pdf_digest, stream),
+                media_type=STREAM_MEDIA_TYPES[stream],
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+            # The stream now owns the temp file.
+            del tmp_path
+            return response
+        final_json = await get_book_analysis(tmp_path, pdf_digest)
+        logger.info("Processed '%s': %d chapters.", final_json.get("book_title"), len(final_json.get("toc") or []))
         return JSONResponse(content=final_json)
+    except uploads.UploadError as e:
+        return upload_error_response(e)
     except Exception as e:
+        logger.exception("Request failed: %s", e)
         return JSONResponse(content={"error": str(e)})
     finally:
         if 'tmp_path' in locals() and os.path.exists(tmp_path):
-            os.unlink(tmp_path)
\ No newline at end of file
+            os.unlink(tmp_path)
+
+
+@app.post("/jobs", openapi_extra=uploads.OPENAPI_PDF_UPLOAD)
+async def submit_job(request: Request):
+    """
+    Job mode of /process-pdf: stores the upload, answers 202 with a job id right away and
+    runs the pipeline in the background. Poll GET /jobs/{job_id} for progress and result.
+    """
+    try:
+        runner = jobs.get_runner()
+        runner.purge()
+        if runner.store.count(jobs.QUEUED) >= jobs.JOB_MAX_QUEUED:
+            retry_after = admission.controller.retry_after()
+            return JSONResponse(
+                status_code=503,
+                headers={"Retry-After": str(retry_after)},
+                content={"error": "Too many queued jobs, please retry later.", "retry_after": retry_after},
+            )
+        os.makedirs(jobs.JOB_FILES_DIR, exist_ok=True)
+        pdf_path, pdf_digest, filename = await uploads.receive_pdf_upload(request, jobs.JOB_FILES_DIR)
+        job_id = runner.store.create(filename, pdf_path, pdf_digest)
+        runner.start(job_id, get_book_analysis)
+        return JSONResponse(
+            status_code=202,
+            content={"job_id": job_id, "status": jobs.QUEUED, "status_url": f"/jobs/{job_id}"},
+        )
+    except uploads.UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        logger.exception("Job submission failed: %s", e)
+        return JSONResponse(content={"error": str(e)})
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Status, per-stage progress and, once completed, the {book_title, authors, toc} result."""
+    job = jobs.get_runner().store.get(job_id)
+    if job is None or jobs.is_expired(job):
+        return JSONResponse(status_code=404, content={"error": "Unknown or expired job id."})
+    return JSONResponse(content=jobs.job_to_dict(job))
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return JSONResponse(content=result_cache.stats())
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint: stage timings, Gemini calls/retries, cache events, payload sizes."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+class BatchRequest(BaseModel):
+    directory: Optional[str] = None
+    manifest: Optional[str] = None
+    output_dir: str = batch.BATCH_OUTPUT_DIR
+    concurrency: int = batch.BATCH_CONCURRENCY
+
+
+@app.post("/batch")
+async def start_batch_endpoint(request: BatchRequest):
+    """
+    Starts processing a directory or manifest of PDFs on the server in the background.
+    Inputs must lie under BATCH_INPUT_ROOTS and the output under BATCH_OUTPUT_ROOT;
+    `concurrency` is capped to BATCH_MAX_CONCURRENCY.
+    Poll GET /batch/{batch_id} for progress and per-book failures.
+    """
+    try:
+        if not request.directory and not request.manifest:
+            return JSONResponse(status_code=400, content={"error": "Either 'directory' or 'manifest' is required."})
+        if not batch.BATCH_INPUT_ROOTS:
+            return JSONResponse(status_code=403, content={"error": "Batches are disabled; set BATCH_INPUT_ROOTS."})
+        for path in (request.directory, request.manifest):
+            if path and not batch.is_within(path, batch.BATCH_INPUT_ROOTS):
+                return JSONResponse(status_code=403, content={"error": f"'{path}' is outside BATCH_INPUT_ROOTS."})
+        if not batch.is_within(request.output_dir, [batch.BATCH_OUTPUT_ROOT]):
+            return JSONResponse(status_code=403, content={"error": "'output_dir' is outside BATCH_OUTPUT_ROOT."})
+
+        def collect():
+            pdf_paths = batch.collect_pdfs(request.directory, request.manifest)
+            # Manifests may list paths anywhere, and directories may contain symlinks.
+            outside = [path for path in pdf_paths if not batch.is_within(path, batch.BATCH_INPUT_ROOTS)]
+            return pdf_paths, outside
+
+        # Walking a whole library and resolving every path is blocking file system work.
+        pdf_paths, outside = await asyncio.to_thread(collect)
+        if outside:
+            return JSONResponse(status_code=403, content={"error": f"{len(outside)} PDFs are outside BATCH_INPUT_ROOTS."})
+        if not pdf_paths:
+            return JSONResponse(status_code=400, content={"error": "No PDFs found."})
+        run = batch.start_batch(pdf_paths, request.output_dir, request.concurrency, analyze_pdf_file)
+        return JSONResponse(content=run.to_dict())
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)})
+
+
+@app.get("/batch/{batch_id}")
+async def batch_status_endpoint(batch_id: str):
+    batch.purge_batches()
+    run = batch.batches.get(batch_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown or expired batch id."})
+    return JSONResponse(content=run.to_dict())
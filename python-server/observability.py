@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import time
+import logging
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# --- Logging Configuration ---
+# LOG_LEVEL is any standard level name; LOG_FORMAT is "text" or "json" (one object per line).
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is
+# emitted as a structured field.
+_STANDARD_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+logger = logging.getLogger(__name__)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single JSON object, including its `extra=` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Configures the root logger once for the server and the command-line tools."""
+    handler = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # Per-request and per-connection lines from the HTTP client are noise even at DEBUG.
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+# --- Prometheus Metrics ---
+# Latency buckets span fast local stages (ms) up to multi-minute model calls.
+_SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+_BYTES_BUCKETS = (1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+STAGE_SECONDS = Histogram(
+    "pdf_lens_stage_seconds",
+    "Wall-clock time spent in each pipeline stage.",
+    ["stage"],
+    buckets=_SECONDS_BUCKETS,
+)
+STAGE_FAILURES = Counter(
+    "pdf_lens_stage_failures_total",
+    "Pipeline stages that ended with an exception.",
+    ["stage"],
+)
+GEMINI_CALLS = Counter(
+    "pdf_lens_gemini_calls_total",
+    "Gemini calls by model and final outcome (after retries).",
+    ["model", "outcome"],
+)
+GEMINI_RETRIES = Counter(
+    "pdf_lens_gemini_retries_total",
+    "Retried Gemini call attempts by model and reason.",
+    ["model", "reason"],
+)
+CACHE_EVENTS = Counter(
+    "pdf_lens_cache_events_total",
+    "Cache lookups and maintenance by cache and event (hit, miss, expired, evicted, shared).",
+    ["cache", "event"],
+)
+ADMISSION_ACTIVE = Gauge("pdf_lens_admission_active", "Book requests currently being processed.")
+ADMISSION_WAITING = Gauge("pdf_lens_admission_waiting", "Book requests waiting for a processing slot.")
+ADMISSION_REJECTED = Counter(
+    "pdf_lens_admission_rejected_total",
+    "Book requests turned away with 503, by reason (queue_full, queue_timeout).",
+    ["reason"],
+)
+PAGES_SKIPPED = Counter(
+    "pdf_lens_pages_skipped_total",
+    "Rendered pages not sent to Gemini, by reason (blank, duplicate).",
+    ["reason"],
+)
+PAYLOAD_BYTES = Histogram(
+    "pdf_lens_payload_bytes",
+    "Size of uploads, upstream requests/responses and API responses.",
+    ["kind"],
+    buckets=_BYTES_BUCKETS,
+)
+
+
+@contextmanager
+def track_stage(stage: str, **fields):
+    """
+    Times the enclosed block as pipeline stage `stage`, recording it in the stage
+    histogram and a DEBUG log line (with `fields` as structured extras). Works in
+    coroutines and in worker threads alike.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.labels(stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        logger.debug("stage %s took %.3fs", stage, elapsed, extra={"stage": stage, "seconds": round(elapsed, 4), **fields})
+
+
+def record_payload(kind: str, size: int) -> None:
+    PAYLOAD_BYTES.labels(kind).observe(size)
+
+
+def render_metrics():
+    """The Prometheus text exposition of every metric and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
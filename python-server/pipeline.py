@@ -0,0 +1,85 @@
+import asyncio
+from typing import Callable, Awaitable, Sequence, List, Optional
+
+
+class ProgressBroadcast:
+    """
+    An `on_progress` callback for one run that several callers wait on: forwards every
+    stage transition to all listeners and replays the current state of each stage to
+    listeners that join while the run is already going.
+    """
+
+    def __init__(self):
+        self.statuses = {}
+        self.listeners = []
+        # Set by the owner of the run while it is going.
+        self.running = False
+
+    def __call__(self, name: str, status: str) -> None:
+        self.statuses[name] = status
+        for listener in list(self.listeners):
+            listener(name, status)
+
+    def add(self, listener: Callable[[str, str], None]) -> None:
+        for name, status in self.statuses.items():
+            listener(name, status)
+        self.listeners.append(listener)
+
+    def remove(self, listener: Callable[[str, str], None]) -> None:
+        self.listeners.remove(listener)
+
+
+class Stage:
+    """
+    One node of a pipeline DAG. `func` is an async callable that receives the results
+    of the stages named in `deps`, in the same order.
+    """
+
+    def __init__(self, name: str, func: Callable[..., Awaitable], deps: Sequence[str] = ()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+async def run_stages(stages: List[Stage], on_progress: Optional[Callable[[str, str], None]] = None) -> dict:
+    """
+    Runs a list of stages as a DAG: every stage starts as soon as all of its
+    dependencies have finished, so independent branches run concurrently.
+    Stages must be listed after the stages they depend on.
+    Returns a dict mapping stage name to result. If any stage fails, the
+    remaining stages are cancelled and the exception is re-raised.
+    `on_progress(stage_name, status)` is called as stages move through "pending",
+    "running", "done" and "failed".
+    """
+    tasks = {}
+
+    def report(name: str, status: str):
+        if on_progress is not None:
+            on_progress(name, status)
+
+    async def run(stage: Stage):
+        inputs = [await tasks[dep] for dep in stage.deps]
+        report(stage.name, "running")
+        try:
+            result = await stage.func(*inputs)
+        except Exception:
+            report(stage.name, "failed")
+            raise
+        report(stage.name, "done")
+        return result
+
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in tasks]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown or later stages: {missing}")
+        report(stage.name, "pending")
+        tasks[stage.name] = asyncio.create_task(run(stage), name=stage.name)
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return {name: task.result() for name, task in tasks.items()}
@@ -0,0 +1,93 @@
+import os
+import asyncio
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+
+from pdf2image import convert_from_path
+
+from observability import track_stage
+
+# --- Render Pool Configuration ---
+# Worker processes rendering pages; rendering is CPU-bound, so one per core by default.
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", str(os.cpu_count() or 1)))
+# pdftoppm processes per render job. Parallelism across jobs comes from the pool, so
+# more than 1 only helps when few books are processed at once.
+RENDER_THREAD_COUNT = int(os.environ.get("RENDER_THREAD_COUNT", "1"))
+# How worker processes are started. Workers are created lazily from a process that
+# already runs the event loop and worker threads, and forking a process with live
+# threads can deadlock, so "fork" is avoided by default.
+RENDER_START_METHOD = os.environ.get(
+    "RENDER_START_METHOD", "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def render_jpeg_pages(pdf_path: str, first_page: int, last_page: int, dpi: int, quality: int,
+                      thread_count: int = 1) -> List[bytes]:
+    """
+    Runs in a worker process: renders the 1-based, inclusive page range straight to JPEG
+    files with pdftoppm and returns their bytes, so no image is decoded or re-encoded in
+    Python. Pages past the end of the document are silently skipped.
+    """
+    with tempfile.TemporaryDirectory() as output_folder:
+        paths = convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            first_page=first_page,
+            last_page=last_page,
+            fmt="jpeg",
+            jpegopt={"quality": quality, "progressive": False, "optimize": True},
+            output_folder=output_folder,
+            paths_only=True,
+            thread_count=thread_count,
+        )
+        pages = []
+        for path in paths:
+            with open(path, "rb") as f:
+                pages.append(f.read())
+        return pages
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=max(1, RENDER_WORKERS), mp_context=multiprocessing.get_context(RENDER_START_METHOD)
+        )
+    return _executor
+
+
+async def render_pages(pdf_path: str, first_page: int, last_page: int, dpi: int, quality: int) -> List[bytes]:
+    """
+    Renders a page range in the worker pool; returns one JPEG per existing page. Jobs
+    beyond RENDER_WORKERS wait for a free worker instead of adding CPU load.
+    """
+    global _executor
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    with track_stage("render", pages=last_page - first_page + 1):
+        try:
+            return await loop.run_in_executor(
+                executor, render_jpeg_pages, pdf_path, first_page, last_page, dpi, quality, RENDER_THREAD_COUNT
+            )
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for later jobs.
+            logger.error("Render worker pool broke; restarting it.")
+            if _executor is executor:
+                _executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
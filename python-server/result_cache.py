@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Optional, Callable, Awaitable
+
+from observability import CACHE_EVENTS
+
+# --- Cache Configuration ---
+# All values can be overridden with environment variables.
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "1") != "0"
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", os.path.join("cache", "results"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Intermediate artifacts of the TOC pipeline (rendered pages, per-chunk model results),
+# so a failed or re-prompted stage does not redo the stages before it.
+STAGE_CACHE_DIR = os.environ.get("STAGE_CACHE_DIR", os.path.join("cache", "stages"))
+STAGE_CACHE_MAX_BYTES = int(os.environ.get("STAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR", os.path.join("cache", "pages"))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(pdf_digest: str, *version_parts: str) -> str:
+    """
+    Builds a cache key from the SHA-256 of the uploaded PDF plus every prompt/model
+    version string that influences the result. Changing any of them yields a new key.
+    """
+    version = hashlib.sha256("|".join(version_parts).encode("utf-8")).hexdigest()[:16]
+    return f"{pdf_digest}-{version}"
+
+
+class DiskCache:
+    """
+    Persistent, size-bounded cache of JSON-serialisable values stored as one file per key.
+    With `binary=True` the values are raw bytes instead (e.g. encoded page images).
+
+    * The file's mtime is its write time and is used for TTL expiry.
+    * The file's atime is bumped explicitly on every hit and is used for LRU eviction.
+    * Concurrent `get_or_compute` calls for the same key share one in-flight computation.
+    """
+
+    # Metric event name -> attribute holding the per-instance count.
+    _EVENT_ATTRIBUTES = {
+        "hit": "hits", "miss": "misses", "expired": "expirations", "evicted": "evictions", "shared": "shared_inflight",
+    }
+
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: int, enabled: bool = True, name: str = "results",
+                 binary: bool = False):
+        self.name = name
+        self.binary = binary
+        self.suffix = ".bin" if binary else ".json"
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.shared_inflight = 0
+        self._inflight = {}
+        # In-flight task -> callers currently awaiting it.
+        self._waiters = {}
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _count(self, event: str) -> None:
+        attribute = self._EVENT_ATTRIBUTES[event]
+        setattr(self, attribute, getattr(self, attribute) + 1)
+        CACHE_EVENTS.labels(self.name, event).inc()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}{self.suffix}"
+
+    def get(self, key: str):
+        """Returns the cached value for `key`, or None on a miss or expired entry."""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self._count("miss")
+            return None
+        if self.ttl_seconds > 0 and time.time() - stat.st_mtime > self.ttl_seconds:
+            self._count("expired")
+            self._count("miss")
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            if self.binary:
+                value = path.read_bytes()
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    value = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self._count("miss")
+            path.unlink(missing_ok=True)
+            return None
+        # Mark as recently used without touching the write time.
+        os.utime(path, (time.time(), stat.st_mtime))
+        self._count("hit")
+        return value
+
+    def put(self, key: str, value) -> None:
+        if not self.enabled:
+            return
+        path = self._path(key)
+        # Write atomically so readers never see a partially written file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            if self.binary:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(value)
+            else:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(value, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._evict()
+
+    def _evict(self) -> None:
+        """Removes least-recently-used entries until the cache fits within `max_bytes`."""
+        entries = []
+        total = 0
+        for path in self.directory.glob(f"*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort(key=lambda entry: entry[0])
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            self._count("evicted")
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable], should_store: Optional[Callable] = None):
+        """
+        Returns the cached value for `key`, computing and storing it on a miss.
+        Callers arriving while the same key is being computed await that computation
+        instead of starting their own. `should_store` can veto caching of a result
+        (e.g. empty or error payloads).
+
+        The computation runs in its own task, which takes its first step before the
+        caller that started it can resume. A cancelled caller (e.g. a client disconnect)
+        leaves it running for the others; it is cancelled once no caller is left.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count("shared")
+        else:
+            task = asyncio.create_task(self._compute_and_store(key, compute, should_store))
+            self._inflight[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(lambda done: self._forget(key, done))
+        self._waiters[task] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    # Callers arriving from now on start a new computation.
+                    self._forget(key, task)
+                    task.cancel()
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable], should_store: Optional[Callable]):
+        value = await compute()
+        if should_store is None or should_store(value):
+            self.put(key, value)
+        return value
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved when every waiter has gone away.
+        if task.done() and not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        entries = 0
+        size = 0
+        if self.enabled:
+            for path in self.directory.glob(f"*{self.suffix}"):
+                try:
+                    size += path.stat().st_size
+                    entries += 1
+                except FileNotFoundError:
+                    continue
+        return {
+            "name": self.name,
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "shared_inflight": self.shared_inflight,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+result_cache = DiskCache(
+    RESULT_CACHE_DIR,
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+    enabled=RESULT_CACHE_ENABLED,
+)
+stage_cache = DiskCache(
+    STAGE_CACHE_DIR,
+    max_bytes=STAGE_CACHE_MAX_BYTES,
+    ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+    enabled=RESULT_CACHE_ENABLED,
+    name="stages",
+)
+page_cache = DiskCache(
+    PAGE_CACHE_DIR,
+    max_bytes=PAGE_CACHE_MAX_BYTES,
+    ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+    enabled=RESULT_CACHE_ENABLED,
+    name="pages",
+    binary=True,
+)
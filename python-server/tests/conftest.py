@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# Caches, job database and job files of the modules under test go to a scratch
+# directory; the settings are read when the modules are first imported.
+_SCRATCH = tempfile.mkdtemp(prefix="toc-server-tests-")
+for name, relative in (
+    ("RESULT_CACHE_DIR", "results"),
+    ("STAGE_CACHE_DIR", "stages"),
+    ("PAGE_CACHE_DIR", "pages"),
+    ("JOB_DB_PATH", "jobs.sqlite3"),
+    ("JOB_FILES_DIR", "job_files"),
+):
+    os.environ.setdefault(name, os.path.join(_SCRATCH, relative))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+import batch
+
+
+def test_api_batches_share_the_concurrency_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "BATCH_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(batch, "_api_slots", None)
+    monkeypatch.setattr(batch, "batches", {})
+    state = {"active": 0, "peak": 0}
+
+    async def process(pdf_path):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        await asyncio.sleep(0.01)
+        state["active"] -= 1
+        return {"toc": [{"title": pdf_path}]}
+
+    async def scenario():
+        runs = [
+            batch.start_batch([f"/library/{n}/{i}.pdf" for i in range(4)], str(tmp_path / str(n)), 100, process)
+            for n in range(3)
+        ]
+        await asyncio.gather(*(run.task for run in runs))
+        return runs
+
+    runs = asyncio.run(scenario())
+    assert [run.concurrency for run in runs] == [2, 2, 2]
+    assert all(len(run.completed) == 4 for run in runs)
+    assert state["peak"] == 2
+
+
+def test_finished_batches_expire(monkeypatch):
+    old, running, recent = (batch.BatchRun([], "out", 1) for _ in range(3))
+    old.finished_at = time.time() - 100
+    recent.finished_at = time.time()
+    monkeypatch.setattr(batch, "batches", {run.id: run for run in (old, running, recent)})
+    assert batch.purge_batches(retention_seconds=50) == 1
+    assert set(batch.batches) == {running.id, recent.id}
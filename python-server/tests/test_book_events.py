@@ -0,0 +1,68 @@
+import asyncio
+import uuid
+
+import main
+import toc_logic
+from result_cache import result_cache
+
+
+def collect(events):
+    async def run():
+        return [(event, data) async for event, data in events]
+    return asyncio.run(run())
+
+
+def test_metadata_is_streamed_before_the_toc_is_verified(tmp_path, monkeypatch):
+    order = []
+
+    async def fake_process_pdf(pdf_path, pdf_digest=None, on_metadata=None):
+        on_metadata({"book_title": "Book", "authors": ["Ada"]})
+        await asyncio.sleep(0.02)
+        order.append("verified")
+        return {"metadata": {"book_title": "Book", "authors": ["Ada"]},
+                "toc_entries": [{"chapter_title": "One", "page_number": 3}]}
+
+    async def fake_headings(pdf_path):
+        return []
+
+    async def fake_match(toc, headings, book_title):
+        return [dict(entry) for entry in toc]
+
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(toc_logic, "process_pdf", fake_process_pdf)
+    monkeypatch.setattr(main, "get_headings", fake_headings)
+    monkeypatch.setattr(main, "match_toc_with_headings", fake_match)
+    pdf_path = tmp_path / "book.pdf"
+    pdf_path.write_bytes(b"%PDF")
+
+    async def run():
+        events = []
+        async for event, data in main.book_events(str(pdf_path), uuid.uuid4().hex):
+            events.append((event, data))
+            order.append(event)
+        return events
+
+    events = asyncio.run(run())
+    assert order == ["metadata", "verified", "toc", "match"]
+    assert events[0] == ("metadata", {"book_title": "Book", "authors": ["Ada"]})
+    assert events[1][1]["toc"][0]["chapter_title"] == "One"
+    assert events[2][1]["toc"] == [{"chapter_title": "One", "page_number": 3}]
+
+
+def test_cached_book_is_streamed_without_running_the_pipeline(tmp_path, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("pipeline should not run for a cached book")
+
+    monkeypatch.setattr(toc_logic, "process_pdf", fail)
+    monkeypatch.setattr(main, "get_headings", fail)
+    digest = uuid.uuid4().hex
+    cached = {"book_title": "Book", "authors": ["Ada"],
+              "toc": [{"chapter_title": "One", "chapter_number": 1, "reference_boolean": False, "page_number": 3}]}
+    result_cache.put(main.book_cache_key(digest), cached)
+
+    events = collect(main.book_events(str(tmp_path / "gone.pdf"), digest))
+    assert events == [
+        ("metadata", {"book_title": "Book", "authors": ["Ada"]}),
+        ("toc", {"toc": [{"chapter_title": "One", "chapter_number": 1, "reference_boolean": False}]}),
+        ("match", cached),
+    ]
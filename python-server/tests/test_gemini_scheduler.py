@@ -0,0 +1,73 @@
+import asyncio
+
+import gemini_scheduler
+from gemini_scheduler import TokenBucket, PRIORITY_DISCOVERY, PRIORITY_MATCH
+
+
+def test_token_bucket_serves_waiters_in_priority_order():
+    async def scenario():
+        bucket = TokenBucket(600)
+        bucket.tokens = 0
+        order = []
+
+        async def caller(name, priority):
+            await bucket.acquire((priority, 0))
+            order.append(name)
+
+        # Discovery calls arrive first, then a match call for the same model.
+        tasks = [asyncio.create_task(caller(f"discovery-{i}", PRIORITY_DISCOVERY)) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(caller("match", PRIORITY_MATCH)))
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["match", "discovery-0", "discovery-1", "discovery-2"]
+
+
+def test_token_bucket_holds_tokens_during_a_pause():
+    async def scenario():
+        bucket = TokenBucket(6000)
+        bucket.pause(0.1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await bucket.acquire((PRIORITY_MATCH, 0))
+        return loop.time() - started
+
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_cancelled_waiter_passes_its_turn_on():
+    async def scenario():
+        bucket = TokenBucket(600)
+        bucket.tokens = 0
+        first = asyncio.create_task(bucket.acquire((PRIORITY_MATCH, 0)))
+        second = asyncio.create_task(bucket.acquire((PRIORITY_DISCOVERY, 0)))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.wait_for(second, timeout=1)
+        return first.cancelled()
+
+    assert asyncio.run(scenario())
+
+
+def test_match_calls_overtake_queued_discovery_calls(monkeypatch):
+    monkeypatch.setattr(gemini_scheduler, "MODEL_LIMITS", {"fake-flash": {"rpm": 600, "concurrency": 8}})
+    scheduler = gemini_scheduler.GeminiScheduler()
+
+    async def scenario():
+        order = []
+        scheduler._model_gates("fake-flash")[1].tokens = 0
+
+        def request(name):
+            async def send():
+                order.append(name)
+            return send
+
+        calls = [scheduler.call("fake-flash", request(f"discovery-{i}"), PRIORITY_DISCOVERY) for i in range(2)]
+        tasks = [asyncio.create_task(call) for call in calls]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(scheduler.call("fake-flash", request("match"), PRIORITY_MATCH)))
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario())[0] == "match"
@@ -0,0 +1,85 @@
+import json
+import asyncio
+import uuid
+
+import jobs
+import main
+from pipeline import Stage
+
+
+def new_job(tmp_path, digest=None):
+    store = jobs.JobStore(str(tmp_path / "jobs.sqlite3"))
+    runner = jobs.JobRunner(store, concurrency=2)
+    pdf_path = tmp_path / f"{uuid.uuid4().hex}.pdf"
+    pdf_path.write_bytes(b"%PDF")
+    job_id = store.create("book.pdf", str(pdf_path), digest or uuid.uuid4().hex)
+    return store, runner, job_id
+
+
+def test_jobs_with_an_empty_toc_or_an_error_payload_fail(tmp_path):
+    payloads = [
+        {"book_title": "Book", "authors": [], "toc": []},
+        {"error": "Gemini API key is not configured."},
+        None,
+    ]
+
+    async def scenario():
+        job_ids = []
+        for payload in payloads:
+            async def process_fn(pdf_path, pdf_digest, on_progress, payload=payload):
+                return payload
+
+            store, runner, job_id = new_job(tmp_path)
+            runner.start(job_id, process_fn)
+            await asyncio.gather(*runner._tasks)
+            job_ids.append((store, job_id))
+        return [store.get(job_id) for store, job_id in job_ids]
+
+    finished = asyncio.run(scenario())
+    assert [job["status"] for job in finished] == [jobs.FAILED] * 3
+    assert finished[0]["error"] == "pipeline produced an empty TOC"
+    assert finished[1]["error"] == "Gemini API key is not configured."
+    assert all(job["result"] is None for job in finished)
+
+
+def test_job_joining_a_running_analysis_gets_its_stage_updates(tmp_path, monkeypatch):
+    release = None
+
+    def fake_stages(pdf_path, pdf_digest):
+        async def toc():
+            await release.wait()
+            return {"toc_entries": [{"chapter_title": "One", "page_number": 1}]}
+
+        async def match(result):
+            return {"book_title": "Book", "authors": [], "toc": result["toc_entries"]}
+
+        return [Stage("toc", toc), Stage("match", match, deps=["toc"])]
+
+    monkeypatch.setattr(main, "build_book_stages", fake_stages)
+    digest = uuid.uuid4().hex
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        store, runner, first = new_job(tmp_path, digest)
+        runner.start(first, main.get_book_analysis)
+        await asyncio.sleep(0.01)
+        second = store.create("book.pdf", str(tmp_path / "copy.pdf"), digest)
+        (tmp_path / "copy.pdf").write_bytes(b"%PDF")
+        runner.start(second, main.get_book_analysis)
+        await asyncio.sleep(0.01)
+        # Joined while "toc" was running: the replay already shows it.
+        joined = json.loads(store.get(second)["stages"])
+        release.set()
+        await asyncio.gather(*runner._tasks)
+        return joined, store.get(first), store.get(second)
+
+    joined, first, second = asyncio.run(scenario())
+    assert joined["toc"]["status"] == "running"
+    assert joined["match"]["status"] == "pending"
+    for job in (first, second):
+        assert job["status"] == jobs.COMPLETED
+        stages = json.loads(job["stages"])
+        assert {name: entry["status"] for name, entry in stages.items()} == {"toc": "done", "match": "done"}
+        assert json.loads(job["result"])["toc"] == [{"chapter_title": "One", "page_number": 1}]
+    assert not main._in_flight_progress
@@ -0,0 +1,100 @@
+import os
+import asyncio
+import uuid
+
+import main
+import toc_logic
+from result_cache import DiskCache
+
+
+def write_pdf(path, content: bytes) -> str:
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_shared_computation_survives_disconnect_of_its_first_caller(tmp_path, monkeypatch):
+    """A streamed request starts the TOC stage, a second upload of the same PDF joins it,
+    then the stream disconnects and removes its upload."""
+    seen_paths = []
+
+    async def fake_process_pdf(pdf_path, pdf_digest=None, on_metadata=None):
+        seen_paths.append(pdf_path)
+        await asyncio.sleep(0.05)
+        with open(pdf_path, "rb") as f:
+            return {"toc_entries": [{"chapter_title": f.read().decode()}], "metadata": {}}
+
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(toc_logic, "process_pdf", fake_process_pdf)
+    digest = uuid.uuid4().hex
+
+    async def request(pdf_path):
+        try:
+            return await main.get_toc_from_new_logic(pdf_path, digest)
+        finally:
+            os.unlink(pdf_path)
+
+    async def scenario():
+        streaming = asyncio.create_task(request(write_pdf(tmp_path / "stream.pdf", b"Chapter One")))
+        await asyncio.sleep(0.01)
+        plain = asyncio.create_task(request(write_pdf(tmp_path / "plain.pdf", b"Chapter One")))
+        await asyncio.sleep(0.01)
+        streaming.cancel()
+        return await plain
+
+    result = asyncio.run(scenario())
+    assert result["toc_entries"] == [{"chapter_title": "Chapter One"}]
+    assert len(seen_paths) == 1
+    assert not os.path.exists(seen_paths[0])
+
+
+def test_computation_is_cancelled_when_its_last_caller_leaves(tmp_path, monkeypatch):
+    state = {}
+
+    async def fake_process_pdf(pdf_path, pdf_digest=None, on_metadata=None):
+        state["path"] = pdf_path
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(toc_logic, "process_pdf", fake_process_pdf)
+
+    async def scenario():
+        caller = asyncio.create_task(
+            main.get_toc_from_new_logic(write_pdf(tmp_path / "book.pdf", b"%PDF"), uuid.uuid4().hex)
+        )
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.gather(caller, return_exceptions=True)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    assert state["cancelled"]
+    assert not os.path.exists(state["path"])
+
+
+def test_caller_after_cancellation_starts_a_new_computation(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1024 * 1024, ttl_seconds=0)
+    calls = []
+
+    async def compute():
+        calls.append(len(calls))
+        await asyncio.sleep(0.02)
+        return {"run": len(calls)}
+
+    async def scenario():
+        first = asyncio.create_task(cache.get_or_compute("key", compute))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        second = await cache.get_or_compute("key", compute)
+        third = await cache.get_or_compute("key", compute)
+        return second, third
+
+    second, third = asyncio.run(scenario())
+    assert second == {"run": 2}
+    # Stored by the second computation.
+    assert third == {"run": 2}
+    assert len(calls) == 2
@@ -0,0 +1,59 @@
+import pymupdf
+
+import text_toc
+
+
+def build_pdf(path, contents=None, outline=None, metadata=None, pages=12) -> str:
+    document = pymupdf.open()
+    for number in range(1, pages + 1):
+        page = document.new_page()
+        if number == 2 and contents:
+            page.insert_text((72, 72), "Contents", fontsize=16)
+            y = 110
+            for title, page_number in contents:
+                # Title and right-aligned page number are written as separate text runs.
+                page.insert_text((72, y), f"{title} {'.' * 20}")
+                page.insert_text((500, y), str(page_number))
+                y += 18
+        else:
+            page.insert_text((72, 300), f"Body text of page {number}.")
+    if outline:
+        document.set_toc(outline)
+    if metadata:
+        document.set_metadata(metadata)
+    document.save(str(path))
+    document.close()
+    return str(path)
+
+
+def test_outline_is_used_as_the_toc(tmp_path):
+    pdf_path = build_pdf(
+        tmp_path / "outline.pdf",
+        outline=[[1, "Contents", 2], [1, "Beginnings", 3], [2, "A Section", 4], [1, "Middles", 6],
+                 [1, "Endings", 9], [1, "References", 11]],
+        metadata={"title": "A Book", "author": "Ann Author and Bob Writer"},
+    )
+    result = text_toc.analyze_text_layer(pdf_path, 20)
+    assert [(entry["chapter_title"], entry["page_number"]) for entry in result["toc_entries"]] == [
+        ("Beginnings", 3), ("Middles", 6), ("Endings", 9), ("References", 11),
+    ]
+    assert result["toc_entries"][-1]["reference_boolean"]
+    assert result["metadata"]["book_title"] == "A Book"
+    assert result["metadata"]["authors"] == ["Ann Author", "Bob Writer"]
+    assert result["page_count"] == 12
+
+
+def test_contents_page_is_found_in_the_text_layer(tmp_path):
+    contents = [("Beginnings", 1), ("Middles", 4), ("Turns", 6), ("Endings", 8), ("Afterword", 10)]
+    pdf_path = build_pdf(tmp_path / "contents.pdf", contents=contents)
+    result = text_toc.analyze_text_layer(pdf_path, 20)
+    assert result["toc_entries"] == []
+    assert result["toc_pages"] == [2]
+    assert result["metadata"]["book_title"] is None
+
+
+def test_unreadable_pdf(tmp_path):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"not a pdf")
+    result = text_toc.analyze_text_layer(str(path), 20)
+    assert result == {"metadata": text_toc._empty_metadata(), "toc_entries": [], "toc_pages": [], "page_count": 0}
@@ -0,0 +1,77 @@
+import toc_matcher
+
+
+def chapters(*titles):
+    return [{"chapter_title": title} for title in titles]
+
+
+def heading(title, page, level=1):
+    return {"title": title, "pageNumber": page, "level": level}
+
+
+def pages(aligned):
+    return [entry["pageNumber"] for entry in aligned]
+
+
+def test_consecutive_chapters_can_start_on_the_same_page():
+    aligned = toc_matcher.align_toc(
+        chapters("Part One: Origins", "The Beginning", "The Middle"),
+        [heading("PART ONE: ORIGINS", 10), heading("THE BEGINNING", 10), heading("THE MIDDLE", 30)],
+    )
+    assert pages(aligned) == [10, 10, 30]
+    assert all(entry["confidence"] == 1.0 for entry in aligned)
+
+
+def test_a_heading_is_not_used_by_two_chapters():
+    aligned = toc_matcher.align_toc(
+        chapters("Mind and Body", "Mind and World"),
+        [heading("MIND AND BODY", 30)],
+    )
+    assert pages(aligned) == [30, None]
+    assert toc_matcher.low_confidence_indices(aligned) == [1]
+
+
+def test_repeated_titles_get_their_own_headings():
+    aligned = toc_matcher.align_toc(
+        chapters("Introduction", "Ancient Wisdom", "Introduction", "Modern Wisdom"),
+        [
+            heading("INTRODUCTION", 5),
+            heading("ANCIENT WISDOM", 9),
+            heading("INTRODUCTION", 120),
+            heading("MODERN WISDOM", 125),
+        ],
+    )
+    assert pages(aligned) == [5, 9, 120, 125]
+
+
+def test_page_order_is_kept():
+    # The only "Epilogue" heading lies before "The Storm", so the later chapter cannot use it.
+    aligned = toc_matcher.align_toc(
+        chapters("The Storm", "Epilogue"),
+        [heading("EPILOGUE", 3), heading("THE STORM", 40)],
+    )
+    assert pages(aligned) == [40, None]
+
+
+def test_unmatched_chapters_keep_their_neighbours_matched():
+    aligned = toc_matcher.align_toc(
+        chapters("The Coming Storm", "Untitled Interlude", "After the Rain"),
+        [heading("COMING STORM", 12), heading("Lorem ipsum", 20), heading("AFTER THE RAIN", 44)],
+    )
+    assert pages(aligned) == [12, None, 44]
+    assert [entry["confidence"] for entry in aligned] == [1.0, 0.0, 1.0]
+    assert toc_matcher.page_window(aligned, 1) == (12, 44)
+
+
+def test_fragmented_title_takes_the_page_of_its_first_fragment():
+    aligned = toc_matcher.align_toc(
+        chapters("LSD Psychotherapy"),
+        [heading("FUTURE", 258), heading("LSD", 262), heading("PSYCHOTHERAPY", 262)],
+    )
+    assert pages(aligned) == [262]
+    assert aligned[0]["confidence"] == 1.0
+
+
+def test_no_headings():
+    aligned = toc_matcher.align_toc(chapters("One Chapter"), {"error": "service unavailable"})
+    assert pages(aligned) == [None]
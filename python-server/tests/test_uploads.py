@@ -0,0 +1,81 @@
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import main
+import uploads
+from result_cache import sha256_file
+
+BOUNDARY = "testboundary"
+
+
+def multipart(*parts) -> bytes:
+    body = b""
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + content + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+HEADERS = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+
+
+def upload_client(directory) -> TestClient:
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        try:
+            path, digest, filename = await uploads.receive_pdf_upload(request, str(directory))
+        except uploads.UploadError as e:
+            return main.upload_error_response(e)
+        return {"path": path, "digest": digest, "filename": filename}
+
+    return TestClient(app)
+
+
+def test_file_part_is_written_and_hashed_and_other_fields_are_ignored(tmp_path):
+    pdf = b"%PDF-1.7\n" + os.urandom(200_000)
+    body = multipart(("title", None, b"ignored"), ("file", "book.pdf", pdf), ("file", "second.pdf", b"also ignored"))
+    response = upload_client(tmp_path).post("/upload", content=body, headers=HEADERS)
+
+    assert response.status_code == 200
+    answer = response.json()
+    assert answer["filename"] == "book.pdf"
+    with open(answer["path"], "rb") as f:
+        assert f.read() == pdf
+    assert answer["digest"] == sha256_file(answer["path"])
+
+
+def test_upload_without_a_file_field_is_rejected(tmp_path):
+    response = upload_client(tmp_path).post("/upload", content=multipart(("title", None, b"x")), headers=HEADERS)
+    assert response.status_code == 400
+    assert os.listdir(tmp_path) == []
+
+    response = upload_client(tmp_path).post("/upload", content=b"{}", headers={"content-type": "application/json"})
+    assert response.status_code == 400
+
+
+def test_oversized_upload_without_content_length_is_cut_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 1000)
+    body = multipart(("file", "book.pdf", b"x" * 5000))
+
+    def chunked():
+        for start in range(0, len(body), 512):
+            yield body[start:start + 512]
+
+    response = upload_client(tmp_path).post("/upload", content=chunked(), headers=HEADERS)
+    assert response.status_code == 413
+    assert response.json()["max_bytes"] == 1000
+    # The partial temp file is removed.
+    assert os.listdir(tmp_path) == []
+
+
+def test_oversized_content_length_is_refused_before_the_body_is_read(monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 1000)
+    monkeypatch.setattr(uploads, "MULTIPART_OVERHEAD_BYTES", 100)
+    body = multipart(("file", "book.pdf", b"x" * 5000))
+    response = TestClient(main.app).post("/match-toc-java", content=body, headers=HEADERS)
+    assert response.status_code == 413
+    assert response.json()["max_bytes"] == 1000
@@ -0,0 +1,195 @@
+import os
+import re
+import logging
+from typing import List, Optional
+
+import pymupdf
+
+logger = logging.getLogger(__name__)
+
+# --- Text Layer Configuration ---
+# Minimum number of usable top-level bookmarks before the outline is trusted as the TOC.
+OUTLINE_MIN_ENTRIES = int(os.environ.get("OUTLINE_MIN_ENTRIES", "3"))
+# Minimum number of "title ..... 12" style lines for a page to count as a contents page.
+TOC_MIN_LINES = int(os.environ.get("TOC_MIN_LINES", "5"))
+# Fraction of a page's non-empty lines that must look like TOC lines.
+TOC_MIN_LINE_RATIO = float(os.environ.get("TOC_MIN_LINE_RATIO", "0.35"))
+
+# Words whose baselines differ by at most this many points are on the same line.
+_BASELINE_TOLERANCE = 3.0
+
+# Bump whenever the detection rules change so cached results are recomputed.
+TEXT_TOC_VERSION = "2"
+
+# Outline entries that are navigation aids rather than chapters.
+_SKIPPED_OUTLINE_TITLES = {
+    "cover", "front cover", "back cover", "title", "title page", "half title", "half-title",
+    "copyright", "copyright page", "contents", "table of contents", "toc",
+}
+_REFERENCE_TITLES = {"bibliography", "references"}
+
+_CONTENTS_HEADER = re.compile(r"^\s*(table\s+of\s+)?contents\s*$", re.IGNORECASE)
+# A title followed by dot leaders or whitespace and a trailing arabic/roman page number.
+_TOC_LINE = re.compile(
+    r"^(?P<title>.*[A-Za-z].*?)(?:\s*[\.…·•_]{2,}\s*|\s+)(?P<page>\d{1,4}|[ivxlcdm]{1,7})\s*$",
+    re.IGNORECASE,
+)
+_DOT_LEADER = re.compile(r"[\.…·•_]{3,}")
+
+
+def _is_reference(title: str) -> bool:
+    return title.strip().lower() in _REFERENCE_TITLES
+
+
+def read_outline(document: pymupdf.Document) -> List[dict]:
+    """
+    Returns the top-level bookmarks of the PDF as TOC entries. Nested bookmarks are
+    sub-chapters and are ignored, matching what the image-based extraction keeps.
+    Page numbers are physical, 1-based PDF page numbers.
+    """
+    try:
+        outline = document.get_toc(simple=True)
+    except Exception as e:
+        logger.warning("Could not read PDF outline: %s", e)
+        return []
+    entries = []
+    for level, title, page_number, *_ in outline:
+        title = (title or "").strip()
+        # Bookmarks without a destination in the document have page -1.
+        if level != 1 or not title or title.lower() in _SKIPPED_OUTLINE_TITLES or page_number < 1:
+            continue
+        entries.append({
+            "chapter_title": title,
+            "page_number": page_number,
+            "reference_boolean": _is_reference(title),
+        })
+    return entries
+
+
+def _empty_metadata() -> dict:
+    return {"book_title": None, "authors": None, "publishing_house": None, "publishing_year": None}
+
+
+def read_metadata(document: pymupdf.Document) -> dict:
+    """Book metadata from the PDF document information dictionary, if present."""
+    metadata = _empty_metadata()
+    info = document.metadata or {}
+    title = (info.get("title") or "").strip()
+    # Skip titles that are obviously just the producing file's name.
+    if title and not re.search(r"\.(docx?|pdf|indd|tex|qxd)$", title, re.IGNORECASE):
+        metadata["book_title"] = title
+    author = (info.get("author") or "").strip()
+    if author:
+        metadata["authors"] = [name.strip() for name in re.split(r";|,\s*and\s+|\s+and\s+|&", author) if name.strip()]
+    return metadata
+
+
+def score_toc_page(text: str) -> dict:
+    """
+    Counts how much of a page's text looks like a table of contents: lines ending in a
+    page number (optionally after dot leaders) and a 'Contents' heading near the top.
+    """
+    lines = [line.strip() for line in (text or "").splitlines() if line.strip()]
+    toc_lines = 0
+    dot_leaders = 0
+    arabic_pages = []
+    for line in lines:
+        match = _TOC_LINE.match(line)
+        if not match or len(match.group("title").strip()) < 2:
+            continue
+        toc_lines += 1
+        if _DOT_LEADER.search(line):
+            dot_leaders += 1
+        if match.group("page").isdigit():
+            arabic_pages.append(int(match.group("page")))
+    increasing = sum(1 for a, b in zip(arabic_pages, arabic_pages[1:]) if b >= a)
+    return {
+        "lines": len(lines),
+        "toc_lines": toc_lines,
+        "dot_leaders": dot_leaders,
+        "has_header": any(_CONTENTS_HEADER.match(line) for line in lines[:6]),
+        "monotonic": increasing / (len(arabic_pages) - 1) if len(arabic_pages) > 1 else 0.0,
+    }
+
+
+def _looks_like_toc(score: dict, continuation: bool) -> bool:
+    if score["lines"] == 0:
+        return False
+    ratio = score["toc_lines"] / score["lines"]
+    min_lines = 3 if (continuation or score["has_header"]) else TOC_MIN_LINES
+    if score["toc_lines"] < min_lines or ratio < TOC_MIN_LINE_RATIO:
+        return False
+    # Page numbers in a contents listing mostly increase; body text with stray
+    # numbers at line ends does not.
+    return score["monotonic"] >= 0.7 or score["dot_leaders"] >= min_lines
+
+
+def page_text(page: pymupdf.Page) -> str:
+    """
+    The page's text with one line per baseline. A right-aligned page number often sits
+    in a text block of its own; joining words by baseline keeps "Title .... 12" together.
+    """
+    lines = []
+    baseline = None
+    for x0, y0, x1, y1, word, *_ in sorted(page.get_text("words"), key=lambda word: (round(word[3]), word[0])):
+        if baseline is not None and abs(y1 - baseline) <= _BASELINE_TOLERANCE:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+            baseline = y1
+    return "\n".join(" ".join(words) for words in lines)
+
+
+def find_toc_pages(document: pymupdf.Document, max_pages: int) -> List[int]:
+    """
+    Returns the 1-based numbers of the first run of contents pages among the first
+    `max_pages` pages, or an empty list if the text layer shows none (e.g. scans).
+    """
+    toc_pages = []
+    for index in range(min(max_pages, document.page_count)):
+        try:
+            text = page_text(document[index])
+        except Exception as e:
+            logger.warning("Could not extract text from page %d: %s", index + 1, e)
+            text = ""
+        if _looks_like_toc(score_toc_page(text), continuation=bool(toc_pages)):
+            toc_pages.append(index + 1)
+        elif toc_pages:
+            break
+    return toc_pages
+
+
+def analyze_text_layer(pdf_path: str, max_pages: int) -> dict:
+    """
+    Cheap pre-stage run before any image rendering, in a render worker process. Returns:
+      * "metadata":    metadata from the PDF info dictionary (fields may be None)
+      * "toc_entries": a complete TOC when the outline is usable, otherwise []
+      * "toc_pages":   1-based contents pages found in the text layer, otherwise []
+      * "page_count":  number of pages in the document, 0 if it could not be read
+    """
+    result = {"metadata": _empty_metadata(), "toc_entries": [], "toc_pages": [], "page_count": 0}
+    try:
+        document = pymupdf.open(pdf_path)
+    except Exception as e:
+        logger.warning("Could not open PDF for text-layer analysis: %s", e)
+        return result
+    with document:
+        result["metadata"] = read_metadata(document)
+        result["page_count"] = document.page_count
+
+        outline_entries = read_outline(document)
+        if len(outline_entries) >= OUTLINE_MIN_ENTRIES:
+            result["toc_entries"] = outline_entries
+            return result
+
+        result["toc_pages"] = find_toc_pages(document, max_pages)
+    return result
+
+
+def merge_metadata(primary: Optional[dict], fallback: Optional[dict]) -> dict:
+    """Fills the None fields of `primary` from `fallback`."""
+    merged = dict(fallback or {})
+    for key, value in (primary or {}).items():
+        if value is not None or key not in merged:
+            merged[key] = value
+    return merged
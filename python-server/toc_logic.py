@@ -1,21 +1,29 @@
+import io
 import sys
 import os
 import asyncio
 import json
-from pathlib import Path
+import logging
+import hashlib
 from PIL import Image
-from typing import Optional, List
+from typing import Callable, Optional, List
 
 # --- Library Check ---
 try:
     import google.generativeai as genai
-    from pdf2image import convert_from_path
+    import render_pool
     from pydantic import BaseModel
-    print("✅ Pre-flight check passed. All libraries are correctly imported.")
+    import text_toc
+    import gemini_scheduler
+    from observability import track_stage, setup_logging, record_payload, PAGES_SKIPPED
+    import image_prep
+    from result_cache import stage_cache, page_cache, make_key, sha256_file
 except ImportError as e:
-    print(f"\n--- ❌ CRITICAL ERROR: A required library failed to import: {e} ---")
+    logging.getLogger(__name__).critical("A required library failed to import: %s", e)
     sys.exit()
 
+logger = logging.getLogger(__name__)
+
 # --- API Configuration ---
 # It's recommended to set this as an environment variable in production
 API_KEY = os.environ.get("GEMINI_API_KEY", "") # Fallback to empty string if not set
@@ -23,12 +31,11 @@ API_KEY = os.environ.get("GEMINI_API_KEY", "") # Fallback to empty string if not
 if API_KEY:
     try:
         genai.configure(api_key=API_KEY)
-        print("API Key configured successfully.")
     except Exception as e:
-        print(f"An error occurred during API configuration: {e}")
+        logger.error("An error occurred during API configuration: %s", e)
         API_KEY = None
 else:
-    print("GEMINI_API_KEY environment variable not set.")
+    logger.warning("GEMINI_API_KEY environment variable not set.")
 
 # --- Pydantic Data Models ---
 
@@ -50,15 +57,29 @@ class ExtractionResult(BaseModel):
 
 # --- Core Logic ---
 
-async def get_structured_data_from_images(model, image_paths: List[str]):
-    """
-    Analyzes a list of image paths using the provided Gemini model and returns structured
-    JSON data containing metadata and TOC entries.
-    """
-    print(f"Processing a chunk of {len(image_paths)} images with model: {model.model_name}...")
-
-    # Updated prompt without 'chapter_number'
-    structured_prompt = """
+DISCOVERY_MODEL = "gemini-2.5-flash"
+VERIFICATION_MODEL = "gemini-2.5-pro"
+
+# Number of leading pages scanned by the discovery pass before it starts extending.
+DISCOVERY_PAGE_LIMIT = int(os.environ.get("DISCOVERY_PAGE_LIMIT", "20"))
+# Pages per discovery model call.
+DISCOVERY_CHUNK_SIZE = 5
+# Discovery chunks sent concurrently in one wave.
+DISCOVERY_WAVE_CHUNKS = int(os.environ.get("DISCOVERY_WAVE_CHUNKS", "2"))
+# When nothing is found, the scanned window grows by this many pages at a time...
+DISCOVERY_EXTEND_PAGES = int(os.environ.get("DISCOVERY_EXTEND_PAGES", "10"))
+# ...up to this hard limit.
+DISCOVERY_MAX_PAGES = int(os.environ.get("DISCOVERY_MAX_PAGES", "50"))
+# Leading pages (title, copyright) added to a text-layer verification for metadata, and
+# sent to the fast model when an outline is used but the PDF info lacks title or authors.
+METADATA_PAGE_COUNT = 4
+# Rendering resolution (pdf2image's default); part of every page and stage cache key.
+RENDER_DPI = int(os.environ.get("RENDER_DPI", "200"))
+# JPEG quality of rendered pages (as written by pdftoppm and kept in the page cache).
+PAGE_CACHE_JPEG_QUALITY = 90
+
+# Updated prompt without 'chapter_number'
+STRUCTURED_PROMPT = """
 Analyze the following book pages to extract metadata and the main table of contents.
 Your response will be programmatically constrained to the JSON schema provided.
 
@@ -83,134 +104,414 @@ If no table of contents entries are found, "toc_entries" MUST be an empty list [
 IMPORTANT: Return ONLY valid JSON. Do NOT include any markdown, explanations, or extra text. The output must be a single valid JSON object and nothing else.
 """
 
-    prompt_parts = [structured_prompt]
-    for path in image_paths:
-        prompt_parts.append(Image.open(path))
+# Identifies the extraction prompt; cached per-chunk model results are keyed by it and their model.
+PROMPT_VERSION = hashlib.sha256(STRUCTURED_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+# Bump whenever the stage logic of process_pdf changes the result for the same inputs.
+PIPELINE_REVISION = "2"
+
+# Identifies the prompt/model combination; results cached under an older version are not reused.
+PIPELINE_VERSION = hashlib.sha256(
+    "|".join([
+        PIPELINE_REVISION, PROMPT_VERSION, DISCOVERY_MODEL, VERIFICATION_MODEL, text_toc.TEXT_TOC_VERSION, str(RENDER_DPI),
+        image_prep.IMAGE_PREP_VERSION,
+    ]).encode("utf-8")
+).hexdigest()[:12]
+
+async def render_pages(pdf_path: str, first_page: int, last_page: int) -> List[bytes]:
+    """
+    Renders the given 1-based, inclusive page range of a PDF to JPEG bytes in the render
+    worker pool. Nothing is written to a shared folder, so concurrent requests cannot
+    clobber each other. Pages past the end of the document are silently skipped.
+    """
+    return await render_pool.render_pages(pdf_path, first_page, last_page, RENDER_DPI, PAGE_CACHE_JPEG_QUALITY)
+
+async def get_structured_data_from_images(model, images: List[Image.Image], priority: int = gemini_scheduler.PRIORITY_DISCOVERY,
+                                          stats: Optional[dict] = None):
+    """
+    Analyzes a list of rendered page images using the provided Gemini model and returns
+    structured JSON data containing metadata and TOC entries.
+    Pages are preprocessed first (see image_prep); blank and repeated pages are not sent.
+    Model calls, image bytes sent and skipped pages are counted in `stats` when given.
+    """
+    prepared = await asyncio.to_thread(image_prep.prepare_images, images)
+    skipped = sum(prepared["skipped"].values())
+    for reason, count in prepared["skipped"].items():
+        if count:
+            PAGES_SKIPPED.labels(reason).inc(count)
+    if stats is not None:
+        stats["pages_skipped"] += skipped
+    logger.debug("Sending %d of %d pages (%d bytes) to %s",
+                 len(prepared["parts"]), len(images), prepared["bytes"], model.model_name)
+    if not prepared["parts"]:
+        # Only blank or repeated pages: there is nothing to find and no call to make.
+        return json.dumps({
+            "metadata": {"book_title": None, "authors": None, "publishing_house": None, "publishing_year": None},
+            "toc_entries": [],
+        })
+    record_payload("gemini_images", prepared["bytes"])
+    if stats is not None:
+        stats["model_calls"] += 1
+        stats["bytes_sent"] += prepared["bytes"]
+
+    prompt_parts = [STRUCTURED_PROMPT]
+    prompt_parts.extend(prepared["parts"])
 
     generation_config = genai.GenerationConfig(
         response_mime_type="application/json",
         response_schema=ExtractionResult
     )
 
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
+    # Rate limits, concurrency caps, priority and 429-aware retries are handled by the
+    # process-wide scheduler shared with every endpoint.
+    try:
+        response = await gemini_scheduler.scheduler.call(
+            model.model_name.removeprefix("models/"),
             # Using asyncio.to_thread for the blocking SDK call
-            response = await asyncio.to_thread(
+            lambda: asyncio.to_thread(
                 model.generate_content,
                 contents=prompt_parts,
                 generation_config=generation_config
-            )
-            return response.text
-        except Exception as e:
-            error_str = str(e)
-            print(f"API call attempt {attempt + 1} failed: {error_str}")
-            if "Deadline Exceeded" in error_str or "503" in error_str:
-                if attempt + 1 < max_retries:
-                    await asyncio.sleep(2 ** attempt) # Exponential backoff
-                else:
-                    return '{"error": "API call failed after multiple retries"}'
-            else:
-                return f'{{"error": "API call failed", "details": "{error_str}"}}'
-    return '{"error": "API call failed after all retries"}'
-
-async def process_pdf(pdf_path: str):
-    """
-    Extracts TOC and metadata from a PDF using a two-pass approach.
-    Pass 1 (Discovery): Uses a fast model to find pages containing the TOC.
-    Pass 2 (Verification): Uses a powerful model on only the identified pages for accurate extraction.
-    """
-    if not API_KEY:
-        print("Cannot proceed without a valid API Key.")
-        return None
-
-    print("\nStep 1: Converting first 20 PDF pages to JPEG images...")
-    output_dir = Path("pages")
-    output_dir.mkdir(exist_ok=True)
-    # Clean up old images before conversion
-    for old_image in output_dir.glob("*.jpg"):
-        old_image.unlink()
-
-    images = convert_from_path(pdf_path, last_page=20, fmt='jpeg', output_folder=output_dir, output_file="page_")
-    image_paths = sorted([str(p) for p in output_dir.glob("*.jpg")])
-    print(f"Successfully converted {len(image_paths)} pages.")
-
-    # --- Pass 1: Discovery Pass with Flash Model ---
-    print("\n--- Starting Pass 1: Discovery (using gemini-2.5-flash) ---")
-    model_flash = genai.GenerativeModel(model_name="gemini-2.5-flash")
-    chunk_size = 5
-    discovery_tasks = []
-    for i in range(0, len(image_paths), chunk_size):
-        chunk_paths = image_paths[i:i + chunk_size]
-        discovery_tasks.append(get_structured_data_from_images(model_flash, chunk_paths))
-    discovery_results = await asyncio.gather(*discovery_tasks)
-
-    toc_page_indices = set()
-    all_parsed_results_pass1 = []
-    for i, res_str in enumerate(discovery_results):
-        try:
-            res_json = json.loads(res_str)
-            all_parsed_results_pass1.append(res_json)
-            if res_json.get("toc_entries"):
-                start_index = i * chunk_size
-                end_index = start_index + chunk_size
-                # Add all page indices from this successful chunk
-                for page_idx in range(start_index, min(end_index, len(image_paths))):
-                    toc_page_indices.add(page_idx)
-        except (json.JSONDecodeError, TypeError):
-            print(f"Warning: Could not parse JSON from discovery chunk {i+1}.")
-            continue
-
-    if not toc_page_indices:
-        print("\n--- Discovery Pass found no pages with TOC entries. Aborting. ---")
-        return None
-
-    print(f"\n--- Discovery Pass identified {len(toc_page_indices)} potential TOC pages. ---")
+            ),
+            priority=priority,
+        )
+        return response.text
+    except Exception as e:
+        error_str = str(e)
+        logger.error("Gemini API call failed: %s", error_str)
+        return json.dumps({"error": "API call failed", "details": error_str})
 
-    # --- Pass 2: Verification Pass with Pro Model ---
-    print("\n--- Starting Pass 2: Verification (using gemini-2.5-pro) ---")
-    model_pro = genai.GenerativeModel(model_name="gemini-2.5-pro")
-    # Create a list of image paths from the discovered indices
-    targeted_image_paths = [image_paths[i] for i in sorted(list(toc_page_indices))]
-    final_result_str = await get_structured_data_from_images(model_pro, targeted_image_paths)
+async def render_page_numbers(pdf_path: str, page_numbers) -> dict:
+    """
+    Renders only the given 1-based pages, grouping them into contiguous runs so each
+    run is a single render job; runs are rendered in parallel. Returns a dict mapping
+    page number to JPEG bytes.
+    """
+    runs = []
+    for page in sorted(set(page_numbers)):
+        if runs and runs[-1][1] == page - 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    results = await asyncio.gather(*(render_pages(pdf_path, first, last) for first, last in runs))
+    rendered = {}
+    for (first, _), pages in zip(runs, results):
+        for offset, data in enumerate(pages):
+            rendered[first + offset] = data
+    return rendered
+
+class PageImages:
+    """
+    Rendered pages of one PDF. Pages are kept in memory for the current run and in the
+    page cache (keyed by PDF hash, page and DPI) across runs, so a retried pass or a
+    re-prompted stage does not rasterize the book again. Only pages actually rendered
+    here are counted in `stats["pages_rendered"]`.
+    """
 
+    def __init__(self, pdf_path: str, pdf_digest: str, stats: dict):
+        self.pdf_path = pdf_path
+        self.pdf_digest = pdf_digest
+        self.stats = stats
+        self.images = {}
+
+    def _cache_key(self, page: int) -> str:
+        return make_key(self.pdf_digest, "page", str(page), str(RENDER_DPI))
+
+    def _load_cached(self, page_numbers) -> None:
+        for page in page_numbers:
+            data = page_cache.get(self._cache_key(page))
+            if data is not None:
+                self.images[page] = Image.open(io.BytesIO(data))
+
+    def _store(self, rendered: dict) -> None:
+        for page, data in rendered.items():
+            self.images[page] = Image.open(io.BytesIO(data))
+            page_cache.put(self._cache_key(page), data)
+
+    async def get(self, page_numbers) -> dict:
+        """Returns the images of the given 1-based pages as a dict page -> image."""
+        page_numbers = sorted(set(page_numbers))
+        # Cache reads and writes are blocking file I/O; keep them off the event loop.
+        await asyncio.to_thread(self._load_cached, [page for page in page_numbers if page not in self.images])
+        missing = [page for page in page_numbers if page not in self.images]
+        if missing:
+            rendered = await render_page_numbers(self.pdf_path, missing)
+            self.stats["pages_rendered"] += len(rendered)
+            await asyncio.to_thread(self._store, rendered)
+        # Pages past the end of the document are simply absent.
+        return {page: self.images[page] for page in page_numbers if page in self.images}
+
+def _is_clean_result(text) -> bool:
+    """True for model output that parses as JSON and is not an error payload."""
     try:
-        final_data = json.loads(final_result_str)
+        parsed = json.loads(text)
     except (json.JSONDecodeError, TypeError):
-        print("\n--- ❌ FINAL RESULT ---")
-        print("ERROR: Failed to parse the final JSON output from the Pro model.")
-        return None
-
-    # --- Final Consolidation ---
-    print("\n--- Consolidating final results ---")
+        return False
+    return isinstance(parsed, dict) and "error" not in parsed
 
-    # Although Pass 2 gives the definitive TOC, we can still pick the best metadata
-    # from the broader scan in Pass 1 for robustness.
+def pick_best_metadata(parsed_results) -> dict:
+    """Picks the metadata object with the most filled-in fields."""
     best_metadata = {}
     max_filled_fields = -1
-    for result in all_parsed_results_pass1:
+    for result in parsed_results:
         metadata = result.get("metadata", {})
         if metadata:
             filled_count = sum(1 for value in metadata.values() if value is not None)
             if filled_count > max_filled_fields:
                 max_filled_fields = filled_count
                 best_metadata = metadata
+    return best_metadata
 
-    # Get the high-quality TOC from the Verification Pass
-    final_combined_toc = final_data.get("toc_entries", [])
+async def run_verification(pages: PageImages, page_numbers, stats: dict):
+    """
+    Pass 2 (Verification): Uses the pro model on the given pages.
+    Returns the parsed JSON, or None if the model output could not be parsed.
+    Parsed results are cached per PDF, page set, model and prompt version.
+    """
+    page_numbers = sorted(set(page_numbers))
+
+    async def verify():
+        images = await pages.get(page_numbers)
+        logger.info("Pass 2: verification of %d pages with %s", len(images), VERIFICATION_MODEL)
+        model_pro = genai.GenerativeModel(model_name=VERIFICATION_MODEL)
+        with track_stage("verification", pages=len(images)):
+            final_result_str = await get_structured_data_from_images(
+                model_pro, [images[page] for page in sorted(images)],
+                priority=gemini_scheduler.PRIORITY_VERIFICATION, stats=stats,
+            )
+        try:
+            return json.loads(final_result_str)
+        except (json.JSONDecodeError, TypeError):
+            logger.error("Failed to parse the final JSON output from the Pro model.")
+            return None
 
-    # Relaxed: Accept all entries from LLM output, no deduplication or filtering
-    final_combined_toc.sort(key=lambda item: item.get('page_number', 0))
+    cache_key = make_key(
+        pages.pdf_digest, "verification", ",".join(map(str, page_numbers)),
+        VERIFICATION_MODEL, PROMPT_VERSION, str(RENDER_DPI), image_prep.IMAGE_PREP_VERSION,
+    )
+    return await stage_cache.get_or_compute(
+        cache_key, verify, should_store=lambda result: isinstance(result, dict) and "error" not in result
+    )
+
+async def run_metadata(pages: PageImages, page_count: int, stats: dict) -> dict:
+    """
+    One fast-model call on the first METADATA_PAGE_COUNT pages for the book's metadata,
+    used when the TOC comes from the outline. Returns {} if nothing could be read.
+    The parsed metadata is cached like a discovery chunk.
+    """
+    last_page = min(METADATA_PAGE_COUNT, page_count) if page_count else METADATA_PAGE_COUNT
+    page_numbers = list(range(1, last_page + 1))
+
+    async def compute():
+        images = await pages.get(page_numbers)
+        if not images:
+            return {}
+        model_flash = genai.GenerativeModel(model_name=DISCOVERY_MODEL)
+        with track_stage("metadata", pages=len(images)):
+            text = await get_structured_data_from_images(
+                model_flash, [images[page] for page in sorted(images)], stats=stats
+            )
+        if not _is_clean_result(text):
+            return {}
+        return json.loads(text).get("metadata") or {}
 
+    cache_key = make_key(
+        pages.pdf_digest, "metadata", f"1-{last_page}", DISCOVERY_MODEL, PROMPT_VERSION, str(RENDER_DPI),
+        image_prep.IMAGE_PREP_VERSION,
+    )
+    return await stage_cache.get_or_compute(cache_key, compute, should_store=bool)
+
+def build_final_result(metadata, toc_entries, stats):
+    # Relaxed: Accept all entries from LLM output, no deduplication or filtering
+    toc_entries.sort(key=lambda item: item.get('page_number', 0))
     final_result_obj = {
-        "metadata": best_metadata,
-        "toc_entries": final_combined_toc
+        "metadata": metadata,
+        "toc_entries": toc_entries,
+        "discovery": stats
+    }
+    logger.info("Extracted %d TOC entries (method: %s, %d model calls, %d pages rendered)",
+                len(toc_entries), stats["method"], stats["model_calls"], stats["pages_rendered"])
+    return final_result_obj
+
+async def run_discovery(pages: PageImages, page_count: int, stats: dict):
+    """
+    Pass 1 (Discovery): Scans the book in waves of DISCOVERY_WAVE_CHUNKS chunks of
+    DISCOVERY_CHUNK_SIZE pages with the fast model.
+    * Stops as soon as a run of TOC chunks has been found and closed by a chunk
+      without entries.
+    * Scans the first DISCOVERY_PAGE_LIMIT pages; if the TOC has not been found (or is
+      still open) at the end of that window, extends it by DISCOVERY_EXTEND_PAGES at a
+      time up to DISCOVERY_MAX_PAGES.
+    Chunk results are cached per PDF, chunk pages, model and prompt version, so a rerun
+    only calls the model (and renders pages) for chunks that failed before.
+    Returns (TOC page numbers, parsed chunk results). Model calls are counted in `stats`.
+    """
+    logger.info("Pass 1: discovery with %s", DISCOVERY_MODEL)
+    model_flash = genai.GenerativeModel(model_name=DISCOVERY_MODEL)
+    last_page = min(page_count, DISCOVERY_MAX_PAGES) if page_count else DISCOVERY_MAX_PAGES
+    window_end = min(DISCOVERY_PAGE_LIMIT, last_page)
+
+    async def discover_chunk(chunk):
+        """Returns {"pages": pages of `chunk` that exist, "text": model output}."""
+        async def compute():
+            images = await pages.get(chunk)
+            if not images:
+                return {"pages": [], "text": None}
+            with track_stage("discovery_chunk", first_page=chunk[0], last_page=chunk[-1]):
+                text = await get_structured_data_from_images(
+                    model_flash, [images[page] for page in sorted(images)], stats=stats
+                )
+            return {"pages": sorted(images), "text": text}
+
+        cache_key = make_key(
+            pages.pdf_digest, "discovery", f"{chunk[0]}-{chunk[-1]}", DISCOVERY_MODEL, PROMPT_VERSION, str(RENDER_DPI),
+            image_prep.IMAGE_PREP_VERSION,
+        )
+        return await stage_cache.get_or_compute(
+            cache_key, compute, should_store=lambda result: bool(result["pages"]) and _is_clean_result(result["text"])
+        )
+
+    scanned = set()
+    toc_pages = []
+    parsed_results = []
+    toc_run_closed = False
+    document_ended = False
+    next_page = 1
+    while next_page <= window_end and not toc_run_closed and not document_ended:
+        wave_end = min(next_page + DISCOVERY_WAVE_CHUNKS * DISCOVERY_CHUNK_SIZE - 1, window_end)
+        logger.debug("Discovery wave: pages %d-%d", next_page, wave_end)
+        chunks = [
+            list(range(chunk_start, min(chunk_start + DISCOVERY_CHUNK_SIZE - 1, wave_end) + 1))
+            for chunk_start in range(next_page, wave_end + 1, DISCOVERY_CHUNK_SIZE)
+        ]
+        chunk_results = await asyncio.gather(*[discover_chunk(chunk) for chunk in chunks])
+
+        for chunk, result in zip(chunks, chunk_results):
+            if len(result["pages"]) < len(chunk):
+                # The document ends inside this chunk.
+                document_ended = True
+            if not result["pages"]:
+                break
+            scanned.update(result["pages"])
+            try:
+                res_json = json.loads(result["text"])
+            except (json.JSONDecodeError, TypeError):
+                logger.warning("Could not parse JSON from discovery chunk %d-%d.", chunk[0], chunk[-1])
+                continue
+            parsed_results.append(res_json)
+            if res_json.get("toc_entries"):
+                # Add all pages from this successful chunk
+                toc_pages.extend(result["pages"])
+            elif toc_pages and "error" not in res_json:
+                # A clean, empty chunk after TOC chunks closes the TOC run.
+                toc_run_closed = True
+                break
+            if document_ended:
+                break
+
+        next_page = wave_end + 1
+        if next_page > window_end and not toc_run_closed and not document_ended and window_end < last_page:
+            window_end = min(window_end + DISCOVERY_EXTEND_PAGES, last_page)
+            logger.info("TOC not found or still open; extending the discovery window to page %d.", window_end)
+
+    stats["pages_scanned"] = len(scanned)
+    return sorted(set(toc_pages)), parsed_results
+
+async def process_pdf(pdf_path: str, pdf_digest: Optional[str] = None,
+                      on_metadata: Optional[Callable[[dict], None]] = None):
+    """
+    Extracts TOC and metadata from a PDF.
+    Pre-stage (Text layer): Uses the PDF outline or the text of the first pages. A usable
+    outline is returned directly; detected contents pages go straight to verification.
+    Pass 1 (Discovery): Uses a fast model, in adaptive waves, to find pages containing the TOC.
+    Only runs when the text layer does not reveal the contents pages (e.g. scanned books).
+    Pass 2 (Verification): Uses a powerful model on only the identified pages for accurate extraction.
+    The result includes a "discovery" entry with the method used, model calls, pages
+    rendered and skipped, and the image bytes sent to Gemini.
+    Rendered pages and the results of both passes are cached by `pdf_digest` (the PDF's
+    SHA-256, computed if not given), so only the stages that failed or changed are rerun.
+    `on_metadata(metadata)` is called once with the result's metadata as soon as it is
+    settled: for scanned books that is after discovery, before the slow verification pass.
+    """
+    # Reported with the result so callers can see what the extraction cost.
+    stats = {
+        "method": "outline", "model_calls": 0, "pages_rendered": 0, "pages_scanned": 0,
+        "pages_skipped": 0, "bytes_sent": 0,
     }
 
-    print("\n\n--- ✅ SUCCESS: COMBINED & PROCESSED FINAL DATA ---")
-    print(json.dumps(final_result_obj, indent=2))
+    def report_metadata(metadata: dict) -> None:
+        if on_metadata is not None:
+            on_metadata(metadata)
+
+    with track_stage("text_layer"):
+        # PyMuPDF text extraction is CPU-bound: run it in the render workers, not in a
+        # thread of the server process.
+        text_layer = await asyncio.get_running_loop().run_in_executor(
+            render_pool.get_executor(), text_toc.analyze_text_layer, pdf_path, DISCOVERY_PAGE_LIMIT
+        )
+    if text_layer["toc_entries"]:
+        logger.info("Using %d top-level entries from the PDF outline; skipping image passes.", len(text_layer["toc_entries"]))
+        metadata = text_layer["metadata"]
+        if API_KEY and not (metadata.get("book_title") and metadata.get("authors")):
+            # Many bookmarked PDFs have an empty or junk info dictionary: read the title
+            # pages instead, with a single fast-model call.
+            if pdf_digest is None:
+                pdf_digest = await asyncio.to_thread(sha256_file, pdf_path)
+            try:
+                model_metadata = await run_metadata(PageImages(pdf_path, pdf_digest, stats), text_layer["page_count"], stats)
+                metadata = text_toc.merge_metadata(model_metadata, metadata)
+            except Exception as e:
+                logger.warning("Could not read metadata from the title pages: %s", e)
+        report_metadata(metadata)
+        return build_final_result(metadata, text_layer["toc_entries"], stats)
 
-    return final_result_obj
+    if not API_KEY:
+        logger.error("Cannot proceed without a valid API Key.")
+        return None
+
+    if pdf_digest is None:
+        pdf_digest = await asyncio.to_thread(sha256_file, pdf_path)
+    pages = PageImages(pdf_path, pdf_digest, stats)
+
+    if text_layer["toc_pages"]:
+        # The text layer already shows where the contents are: skip discovery and verify
+        # those pages, plus the first few pages for title/author/publisher metadata.
+        toc_pages = text_layer["toc_pages"]
+        logger.info("Text layer shows contents on pages %s; skipping the discovery pass.", toc_pages)
+        target_pages = sorted(set(range(1, METADATA_PAGE_COUNT + 1)) | set(toc_pages))
+        stats["method"] = "text_layer"
+        final_data = await run_verification(pages, target_pages, stats)
+        if final_data is not None and final_data.get("toc_entries"):
+            metadata = text_toc.merge_metadata(final_data.get("metadata"), text_layer["metadata"])
+            report_metadata(metadata)
+            return build_final_result(metadata, final_data.get("toc_entries", []), stats)
+        logger.info("Verification of text-layer contents pages found no entries; falling back to image discovery.")
+
+    stats["method"] = "images"
+    toc_pages, all_parsed_results_pass1 = await run_discovery(pages, text_layer["page_count"], stats)
+    logger.info("Discovery used %d model calls (%d image bytes) on %d rendered pages.",
+                stats["model_calls"], stats["bytes_sent"], stats["pages_rendered"])
+
+    if not toc_pages:
+        logger.warning("Discovery pass found no pages with TOC entries. Aborting.")
+        return None
+
+    logger.info("Discovery pass identified %d potential TOC pages: %s", len(toc_pages), toc_pages)
+
+    # Although Pass 2 gives the definitive TOC, we can still pick the best metadata
+    # from the broader scan in Pass 1 for robustness. It is known before Pass 2 runs.
+    best_metadata = text_toc.merge_metadata(pick_best_metadata(all_parsed_results_pass1), text_layer["metadata"])
+    report_metadata(best_metadata)
+
+    # --- Pass 2: Verification Pass with Pro Model ---
+    # The discovered pages are already rendered (in memory or in the page cache).
+    final_data = await run_verification(pages, toc_pages, stats)
+    if final_data is None:
+        return None
+
+    # --- Final Consolidation ---
+    # Get the high-quality TOC from the Verification Pass
+    return build_final_result(best_metadata, final_data.get("toc_entries", []), stats)
 
 ## This main function is for standalone testing of this script.
 ## In the FastAPI app, you will import and call `process_pdf` directly.
@@ -223,8 +524,10 @@ async def main():
     if not os.path.exists(pdf_path):
         print(f"Error: File not found at {pdf_path}")
         sys.exit(1)
-    
-    await process_pdf(pdf_path)
+
+    setup_logging()
+    result = await process_pdf(pdf_path)
+    print(json.dumps(result, indent=2))
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
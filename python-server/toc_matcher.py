@@ -0,0 +1,354 @@
+import os
+import re
+from difflib import SequenceMatcher
+from typing import List, Optional
+
+# --- Matcher Configuration ---
+# Chapters whose best local match scores below this are sent to Gemini as a fallback.
+MATCH_CONFIDENCE_THRESHOLD = float(os.environ.get("MATCH_CONFIDENCE_THRESHOLD", "0.8"))
+# Candidates scoring below this are never considered a match.
+MIN_SIMILARITY = float(os.environ.get("MATCH_MIN_SIMILARITY", "0.55"))
+# Maximum number of consecutive same-page fragments merged into one candidate title.
+MAX_FRAGMENTS = int(os.environ.get("MATCH_MAX_FRAGMENTS", "4"))
+# Pairs sharing fewer words than this (token F1) skip the character-level comparison.
+MIN_TOKEN_OVERLAP = 0.3
+# Printed TOC page numbers usually trail physical page numbers by the length of the
+# front matter; headings further than this past the last TOC page are not sent to Gemini.
+MATCH_PAGE_SLACK = int(os.environ.get("MATCH_PAGE_SLACK", "60"))
+# Joins consecutive same-page fragments in the compacted Gemini prompt.
+FRAGMENT_SEPARATOR = " | "
+# Small preference for headings whose font size marks them as primary ('level': 1).
+LEVEL_ONE_BONUS = 0.05
+
+# Bump whenever the alignment rules change so cached results are recomputed.
+MATCHER_VERSION = "3"
+
+ARTICLES = {"the", "a", "an"}
+NOISE_WORDS = {
+    "the", "a", "an", "of", "and", "or", "in", "on", "to", "for", "with", "at", "by",
+    "from", "is", "as", "past", "level", "page", "contents",
+}
+
+_LEADING_LABEL = re.compile(
+    r"^(chapter|part|section|book|unit)\s+([0-9]+|[ivxlcdm]+|one|two|three|four|five|six|seven|eight|nine|ten)\b\s*[\.:\-]?\s*",
+    re.IGNORECASE,
+)
+_LEADING_NUMBERING = re.compile(r"^([0-9]+[\.\):\-]?|[ivxlcdm]+[\.\)])\s+", re.IGNORECASE)
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_title(text: str) -> str:
+    """
+    Lower-cases a title, strips chapter numbering ('3.', 'Chapter IV:'), punctuation
+    and articles so that 'The Coming Storm' and 'COMING STORM' compare equal.
+    """
+    text = (text or "").strip().replace("&", " and ")
+    text = _LEADING_LABEL.sub("", text)
+    text = _LEADING_NUMBERING.sub("", text)
+    tokens = [token for token in _NON_WORD.sub(" ", text.lower()).split() if token not in ARTICLES]
+    return " ".join(tokens)
+
+
+def is_noise(title: str) -> bool:
+    """
+    True for heading fragments that can never be a chapter title on their own:
+    empty strings, pure symbols/punctuation/numbers and single common words.
+    """
+    title = (title or "").strip()
+    if not any(ch.isalpha() for ch in title):
+        return True
+    words = _NON_WORD.sub(" ", title.lower()).split()
+    if len(words) == 1 and (words[0] in NOISE_WORDS or len(words[0]) <= 1):
+        return True
+    return False
+
+
+def clean_headings(java_headings) -> List[dict]:
+    """
+    Drops malformed and noise entries and returns the rest ordered by page number.
+    The sort is stable, so fragments that were consecutive on a page stay consecutive.
+    """
+    if not isinstance(java_headings, list):
+        return []
+    cleaned = []
+    for heading in java_headings:
+        if not isinstance(heading, dict):
+            continue
+        page = heading.get("pageNumber")
+        title = heading.get("title")
+        if not isinstance(page, int) or page < 1 or not isinstance(title, str) or is_noise(title):
+            continue
+        cleaned.append({"title": title.strip(), "pageNumber": page, "level": heading.get("level", 0)})
+    cleaned.sort(key=lambda heading: heading["pageNumber"])
+    return cleaned
+
+
+def build_candidates(headings: List[dict]) -> List[dict]:
+    """
+    Builds candidate titles from single headings and from runs of up to MAX_FRAGMENTS
+    consecutive headings on the same page. A merged candidate takes the page of its
+    first fragment and the highest level among its fragments; `start` and `end` are
+    the indices of its first and last fragment in `headings`.
+    """
+    candidates = []
+    for start in range(len(headings)):
+        page = headings[start]["pageNumber"]
+        parts = []
+        level = 0
+        for end in range(start, min(start + MAX_FRAGMENTS, len(headings))):
+            if headings[end]["pageNumber"] != page:
+                break
+            parts.append(headings[end]["title"])
+            level = max(level, headings[end].get("level") or 0)
+            text = " ".join(parts)
+            norm = normalize_title(text)
+            if norm:
+                candidates.append({
+                    "text": text,
+                    "norm": norm,
+                    "tokens": set(norm.split()),
+                    "pageNumber": page,
+                    "level": level,
+                    "start": start,
+                    "end": end,
+                })
+    return candidates
+
+
+def title_similarity(a: str, a_tokens: set, b: str, b_tokens: set) -> float:
+    """Similarity in [0, 1] of two normalized titles."""
+    if a == b:
+        return 1.0
+    if not a_tokens & b_tokens:
+        return 0.0
+    shared = len(a_tokens & b_tokens)
+    token_f1 = 2.0 * shared / (len(a_tokens) + len(b_tokens))
+    if token_f1 < MIN_TOKEN_OVERLAP:
+        return token_f1
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    # quick_ratio() is a cheap upper bound of ratio(); skip the full diff when it cannot win.
+    if matcher.quick_ratio() <= max(token_f1, MIN_SIMILARITY):
+        return token_f1
+    return max(matcher.ratio(), token_f1)
+
+
+def align_toc(toc: List[dict], java_headings) -> List[dict]:
+    """
+    Assigns a starting page to every TOC chapter by aligning the chapters with the
+    heading candidates in page order.
+
+    The alignment is a monotonic dynamic program (like a longest common subsequence):
+    chapters keep their TOC order, every chosen page is at or after the previous one
+    and the total similarity of the chosen matches is maximised. Consecutive chapters
+    may start on the same page (a part title and its first chapter often do), but no
+    two chapters use the same heading fragment.
+    Chapters without any acceptable candidate are left unmatched.
+
+    Returns one entry per TOC chapter: {title, pageNumber, level, confidence, source}.
+    """
+    titles = [entry.get("chapter_title") or "" for entry in toc]
+    chapters = []
+    for title in titles:
+        norm = normalize_title(title)
+        chapters.append((norm, set(norm.split())))
+
+    candidates = build_candidates(clean_headings(java_headings))
+
+    # Only chapter/candidate pairs sharing at least one word can reach MIN_SIMILARITY.
+    chapters_by_token = {}
+    for i, (_, tokens) in enumerate(chapters):
+        for token in tokens - NOISE_WORDS:
+            chapters_by_token.setdefault(token, set()).add(i)
+
+    # matches[i] = (score, similarity, candidate) for every acceptable candidate of chapter i
+    matches = [[] for _ in chapters]
+    similarities = {}
+    for candidate in candidates:
+        related = set()
+        for token in candidate["tokens"] - NOISE_WORDS:
+            related |= chapters_by_token.get(token, set())
+        for i in related:
+            norm, tokens = chapters[i]
+            key = (i, candidate["norm"])
+            similarity = similarities.get(key)
+            if similarity is None:
+                similarity = title_similarity(norm, tokens, candidate["norm"], candidate["tokens"])
+                similarities[key] = similarity
+            if similarity < MIN_SIMILARITY:
+                continue
+            score = similarity + (LEVEL_ONE_BONUS if candidate["level"] == 1 else 0.0)
+            matches[i].append((score, similarity, candidate))
+
+    # The columns are positions between heading fragments, which are in page order. Only
+    # the positions where an acceptable candidate starts or ends can change the table.
+    positions = sorted({
+        position for row in matches for _, _, candidate in row
+        for position in (candidate["start"], candidate["end"] + 1)
+    })
+    column = {position: k for k, position in enumerate(positions)}
+    # ending[i][k] = matches of chapter i whose last fragment is just before column k
+    ending = [{} for _ in chapters]
+    for i, row in enumerate(matches):
+        for match in row:
+            ending[i].setdefault(column[match[2]["end"] + 1], []).append(match)
+
+    # table[i][k] = best total score of the first i chapters using fragments before column k
+    n, m = len(chapters), len(positions)
+    table = [[0.0] * m for _ in range(n + 1)]
+    for i in range(1, n + 1):
+        row, prev_row, ends = table[i], table[i - 1], ending[i - 1]
+        for k in range(m):
+            value = prev_row[k]
+            if k and row[k - 1] > value:
+                value = row[k - 1]
+            for score, _, candidate in ends.get(k, ()):
+                value = max(value, prev_row[column[candidate["start"]]] + score)
+            row[k] = value
+
+    assignment = [None] * n
+    i, k = n, m - 1
+    while i > 0 and k > 0:
+        taken = None
+        for match in ending[i - 1].get(k, ()):
+            if table[i][k] == table[i - 1][column[match[2]["start"]]] + match[0]:
+                taken = match
+                break
+        if taken is not None:
+            # The previous chapter must end before this match's first fragment.
+            assignment[i - 1] = taken
+            k = column[taken[2]["start"]]
+            i -= 1
+        elif table[i][k] == table[i - 1][k]:
+            i -= 1
+        else:
+            k -= 1
+
+    aligned = []
+    for title, match in zip(titles, assignment):
+        if match is None:
+            aligned.append({"title": title, "pageNumber": None, "level": None, "confidence": 0.0, "source": "local"})
+        else:
+            _, similarity, candidate = match
+            aligned.append({
+                "title": title,
+                "pageNumber": candidate["pageNumber"],
+                "level": candidate["level"],
+                "confidence": round(similarity, 3),
+                "source": "local",
+            })
+    return aligned
+
+
+def low_confidence_indices(aligned: List[dict], threshold: Optional[float] = None) -> List[int]:
+    threshold = MATCH_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    return [i for i, entry in enumerate(aligned) if entry["confidence"] < threshold]
+
+
+def page_window(aligned: List[dict], index: int, threshold: Optional[float] = None):
+    """
+    Returns the inclusive page interval [low, high] a chapter must fall in to keep the
+    page order non-decreasing with respect to its confidently matched neighbours.
+    `high` is None when no confident chapter follows.
+    """
+    threshold = MATCH_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    low, high = 0, None
+    for entry in reversed(aligned[:index]):
+        if entry["confidence"] >= threshold and entry["pageNumber"] is not None:
+            low = entry["pageNumber"]
+            break
+    for entry in aligned[index + 1:]:
+        if entry["confidence"] >= threshold and entry["pageNumber"] is not None:
+            high = entry["pageNumber"]
+            break
+    return low, high
+
+
+def headings_in_windows(java_headings, windows) -> List[dict]:
+    """Keeps only the (noise-free) headings whose page lies inside one of the windows."""
+    return [
+        heading for heading in clean_headings(java_headings)
+        if any(heading["pageNumber"] >= low and (high is None or heading["pageNumber"] <= high)
+               for low, high in windows)
+    ]
+
+
+def apply_fallback(aligned: List[dict], indices: List[int], fallback_chapters, threshold: Optional[float] = None) -> int:
+    """
+    Merges page numbers proposed by the Gemini fallback into `aligned` for the chapters
+    at `indices`. A proposal is only accepted if it keeps the chapter between its
+    confident neighbours. Returns the number of chapters updated.
+    """
+    if not isinstance(fallback_chapters, list):
+        return 0
+    proposals = []
+    for item in fallback_chapters:
+        if isinstance(item, dict) and isinstance(item.get("pageNumber"), int) and item.get("title"):
+            norm = normalize_title(item["title"])
+            proposals.append((norm, set(norm.split()), item))
+
+    updated = 0
+    for index in indices:
+        entry = aligned[index]
+        norm = normalize_title(entry["title"])
+        tokens = set(norm.split())
+        scored = [
+            (title_similarity(norm, tokens, p_norm, p_tokens), item)
+            for p_norm, p_tokens, item in proposals
+        ]
+        scored = [pair for pair in scored if pair[0] >= MIN_SIMILARITY]
+        if not scored:
+            continue
+        _, item = max(scored, key=lambda pair: pair[0])
+        low, high = page_window(aligned, index, threshold)
+        page = item["pageNumber"]
+        if page < low or (high is not None and page > high):
+            continue
+        entry["pageNumber"] = page
+        entry["level"] = item.get("level", entry["level"])
+        entry["source"] = "gemini"
+        updated += 1
+    return updated
+
+
+def restrict_to_toc_span(headings: List[dict], toc: List[dict], slack: Optional[int] = None) -> List[dict]:
+    """
+    Keeps headings between the first printed TOC page and the last printed TOC page
+    plus `slack`. Physical pages are normally at or after printed pages, so nothing a
+    chapter can start on is dropped. If the TOC has no page numbers, or the span would
+    leave fewer headings than chapters (e.g. an excerpt with high printed numbers),
+    the headings are returned unchanged.
+    """
+    slack = MATCH_PAGE_SLACK if slack is None else slack
+    pages = [entry.get("page_number") for entry in toc if isinstance(entry.get("page_number"), int)]
+    pages = [page for page in pages if page > 0]
+    if not pages:
+        return headings
+    low, high = min(pages), max(pages) + slack
+    restricted = [heading for heading in headings if low <= heading["pageNumber"] <= high]
+    return restricted if len(restricted) >= len(toc) else headings
+
+
+def merge_same_page_fragments(headings: List[dict]) -> List[dict]:
+    """
+    Joins runs of consecutive headings on the same page into one entry, keeping the
+    page and the highest level, so a title split over several lines arrives whole.
+    """
+    merged = []
+    for heading in headings:
+        previous = merged[-1] if merged else None
+        if previous is not None and previous["pageNumber"] == heading["pageNumber"]:
+            previous["title"] += FRAGMENT_SEPARATOR + heading["title"]
+            previous["level"] = max(previous["level"] or 0, heading.get("level") or 0)
+        else:
+            merged.append(dict(heading))
+    return merged
+
+
+def compact_headings_for_prompt(java_headings, toc: List[dict]) -> List[dict]:
+    """
+    Local pre-processing before headings are embedded in the Gemini match prompt:
+    drops noise, restricts to the page span implied by the TOC and merges
+    consecutive same-page fragments.
+    """
+    headings = restrict_to_toc_span(clean_headings(java_headings), toc)
+    return merge_same_page_fragments(headings)
@@ -0,0 +1,159 @@
+import os
+import hashlib
+import tempfile
+from typing import Optional, Tuple
+
+from fastapi import Request
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from observability import track_stage, record_payload
+
+# --- Upload Configuration ---
+# Largest accepted PDF upload (bytes); larger uploads are answered with 413.
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+# Write buffer of the upload's temp file; the body itself arrives in the server's chunks.
+UPLOAD_CHUNK_BYTES = int(os.environ.get("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+# Room for the multipart envelope (boundaries, part headers, other fields) around the PDF.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Form field holding the PDF, as in the former `file: UploadFile = File(...)` parameters.
+UPLOAD_FIELD = b"file"
+
+# Documents the request body of the endpoints that read the upload themselves.
+OPENAPI_PDF_UPLOAD = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+
+class UploadError(Exception):
+    """A request whose PDF upload cannot be accepted; `status_code` is the HTTP answer."""
+
+    status_code = 400
+
+
+class UploadTooLarge(UploadError):
+    status_code = 413
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Uploaded file exceeds the limit of {max_bytes} bytes.")
+        self.max_bytes = max_bytes
+
+
+class _FilePartWriter:
+    """
+    Multipart parser callbacks: the first part named UPLOAD_FIELD goes to `out` and
+    into the SHA-256 as it arrives; every other part is dropped.
+    """
+
+    def __init__(self, out, max_bytes: int):
+        self.out = out
+        self.max_bytes = max_bytes
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.filename = None
+        self.found = False
+        self.too_large = False
+        self._in_file = False
+        self._headers = {}
+        self._field = b""
+        self._value = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._field.lower()] = self._value
+        self._field = b""
+        self._value = b""
+
+    def on_headers_finished(self) -> None:
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if params.get(b"name") == UPLOAD_FIELD and not self.found:
+            self.found = True
+            self._in_file = True
+            filename = params.get(b"filename")
+            self.filename = filename.decode("utf-8", "replace") if filename else None
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if not self._in_file or self.too_large:
+            return
+        chunk = data[start:end]
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.too_large = True
+            return
+        self.digest.update(chunk)
+        self.out.write(chunk)
+
+    def on_part_end(self) -> None:
+        self._in_file = False
+
+
+async def receive_pdf_upload(request: Request, directory: Optional[str] = None) -> Tuple[str, str, Optional[str]]:
+    """
+    Parses the multipart body straight from the request stream and writes the "file"
+    part to a temporary file (in `directory` if given), hashing it on the way. The PDF
+    is written once and never held in memory, and an upload is cut off as soon as it
+    passes MAX_UPLOAD_BYTES, with or without a Content-Length.
+    Returns (temp file path, SHA-256 of the PDF, client file name); every pipeline
+    stage then reads that one file. Raises UploadError / UploadTooLarge.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadError("Expected a multipart/form-data upload with a 'file' field.")
+
+    with track_stage("upload"):
+        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf", dir=directory, buffering=UPLOAD_CHUNK_BYTES)
+        try:
+            with tmp:
+                writer = _FilePartWriter(tmp, MAX_UPLOAD_BYTES)
+                parser = MultipartParser(boundary, writer.callbacks())
+                received = 0
+                async for chunk in request.stream():
+                    received += len(chunk)
+                    if received > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+                        raise UploadTooLarge(MAX_UPLOAD_BYTES)
+                    parser.write(chunk)
+                    if writer.too_large:
+                        raise UploadTooLarge(MAX_UPLOAD_BYTES)
+                parser.finalize()
+            if not writer.found:
+                raise UploadError("The upload has no 'file' field.")
+        except FormParserError as e:
+            os.unlink(tmp.name)
+            raise UploadError(f"Malformed multipart upload: {e}")
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+        record_payload("upload", writer.size)
+    return tmp.name, writer.digest.hexdigest(), writer.filename